@@ -0,0 +1,181 @@
+"""
+Admission control for endpoints that call upstream services (Toolhouse, Gemini)
+
+Requests pass through two gates:
+1. A per-client token bucket that rejects bursts from a single client with 429
+2. A per-upstream concurrency limit with a bounded wait queue; when the queue is
+   full, or a request waits past its deadline, it is shed with 503
+
+Both rejections carry a Retry-After header. Counters are exposed through metrics().
+"""
+
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+
+class TokenBucket:
+    """Per-client token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity, max_clients=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client_id -> (tokens, last_refill), least recently seen first
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def try_acquire(self, client_id):
+        """Take one token for client_id. Returns (allowed, seconds until a token is available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last_refill = self._buckets.get(client_id, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last_refill) * self.rate)
+
+            if tokens >= 1:
+                self._buckets[client_id] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[client_id] = (tokens, now)
+                self.rejected += 1
+                allowed, retry_after = False, (1 - tokens) / self.rate
+            self._buckets.move_to_end(client_id)
+
+            # Too many clients tracked: forget the least recently seen ones, whose
+            # buckets have had the longest to refill
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        return allowed, retry_after
+
+    def metrics(self):
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.capacity,
+            "tracked_clients": len(self._buckets),
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamLimiter:
+    """Bound the in-flight calls to one upstream service.
+
+    At most `max_concurrency` calls run at once, at most `max_queue` requests wait
+    for a slot, and no request waits longer than `queue_timeout` seconds.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+
+    def _shed(self, detail):
+        raise HTTPException(
+            status_code=503,
+            detail=f"{self.name} is overloaded: {detail}",
+            headers={"Retry-After": str(math.ceil(self.queue_timeout))},
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """Run the blocking upstream call `func` in the threadpool once a slot is free."""
+        if self.queued >= self.max_queue and self._semaphore.locked():
+            self.rejected_queue_full += 1
+            self._shed("too many queued requests")
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_deadline += 1
+            self._shed("timed out waiting for a free slot")
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            return await run_in_threadpool(func, *args, **kwargs)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def metrics(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "completed": self.completed,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_deadline": self.rejected_deadline,
+        }
+
+
+# Limits can be tuned per deployment through environment variables
+client_rate_limiter = TokenBucket(
+    rate=float(os.getenv("CLIENT_RATE_PER_SECOND", "1")),
+    capacity=float(os.getenv("CLIENT_BURST", "5")),
+)
+toolhouse_limiter = UpstreamLimiter(
+    "Toolhouse API",
+    max_concurrency=int(os.getenv("TOOLHOUSE_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("TOOLHOUSE_MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("TOOLHOUSE_QUEUE_TIMEOUT", "10")),
+)
+gemini_limiter = UpstreamLimiter(
+    "Gemini API",
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("GEMINI_MAX_QUEUE", "16")),
+    queue_timeout=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "10")),
+)
+
+
+# Header carrying the client address, only set when a trusted proxy in front of the API
+# overwrites it (e.g. X-Forwarded-For or X-Real-IP). Client-chosen headers such as
+# X-Client-Id are ignored: rotating them would bypass the per-client limit.
+TRUSTED_CLIENT_HEADER = os.getenv("TRUSTED_CLIENT_HEADER")
+
+
+def client_id(request: Request):
+    """Identify the caller by its address, as seen by the server or the trusted proxy."""
+    if TRUSTED_CLIENT_HEADER:
+        header = request.headers.get(TRUSTED_CLIENT_HEADER)
+        if header:
+            # The proxy appends the address it saw to any client-supplied list
+            return header.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def rate_limit(request: Request):
+    """FastAPI dependency applying the per-client token bucket."""
+    allowed, retry_after = client_rate_limiter.try_acquire(client_id(request))
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+def admission_metrics():
+    """Snapshot of rate limiting and upstream queue counters."""
+    return {
+        "client_rate_limit": client_rate_limiter.metrics(),
+        "upstreams": {
+            "toolhouse": toolhouse_limiter.metrics(),
+            "gemini": gemini_limiter.metrics(),
+        },
+    }
@@ -0,0 +1,115 @@
+"""
+Content-addressed storage for large advice bodies
+
+Toolhouse advice is kilobytes of markdown and the same text used to be copied into
+every file that mentioned it. Here each large string is written once under its
+SHA-256 and replaced in stored payloads by a reference {"$blob": "<sha256>"}.
+References are resolved when a payload is read.
+
+Client data may contain its own "$blob" keys, so dict keys starting with "$" get an
+extra "$" on ingest and lose it on resolve; only references written here keep the
+bare key.
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+from functools import lru_cache
+
+BLOB_DIR = "blobs"
+
+# Strings at least this long are moved into the blob store
+BLOB_MIN_SIZE = 512
+
+# Key marking a blob reference inside a stored payload
+BLOB_REF_KEY = "$blob"
+ESCAPE_PREFIX = "$"
+BLOB_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+# Keys of the API envelope that the frontend posts back to /api/portfolios/store
+ENVELOPE_KEYS = {"success", "message", "data"}
+
+
+def _blob_path(blob_id):
+    return os.path.join(BLOB_DIR, blob_id[:2], f"{blob_id}.txt")
+
+
+def put_blob(text):
+    """Store text once under its SHA-256 and return the blob ID"""
+    data = text.encode("utf-8")
+    blob_id = hashlib.sha256(data).hexdigest()
+    path = _blob_path(blob_id)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a unique temporary file first so readers never see a partial blob
+        # and concurrent writers of the same blob do not share one
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return blob_id
+
+
+@lru_cache(maxsize=256)
+def get_blob(blob_id):
+    """Return the text stored under blob_id"""
+    if not isinstance(blob_id, str) or not BLOB_ID_PATTERN.fullmatch(blob_id):
+        raise ValueError(f"Invalid blob ID {blob_id!r}")
+    with open(_blob_path(blob_id), "rb") as f:
+        return f.read().decode("utf-8")
+
+
+def flatten_response_json(response_json):
+    """Unwrap API envelopes nested inside response_json
+
+    The frontend stores the whole /api/generate-portfolio response as response_json,
+    which itself carries the Toolhouse reply in data.response_json. Only the
+    innermost Toolhouse reply is kept.
+    """
+    while (
+        isinstance(response_json, dict)
+        and ENVELOPE_KEYS <= response_json.keys()
+        and isinstance(response_json["data"], dict)
+        and isinstance(response_json["data"].get("response_json"), dict)
+    ):
+        response_json = response_json["data"]["response_json"]
+    return response_json
+
+
+def _escape_key(key):
+    return ESCAPE_PREFIX + key if isinstance(key, str) and key.startswith(ESCAPE_PREFIX) else key
+
+
+def _unescape_key(key):
+    return key[len(ESCAPE_PREFIX):] if isinstance(key, str) and key.startswith(ESCAPE_PREFIX * 2) else key
+
+
+def dedupe(value, store_blobs=True):
+    """Escape "$" keys in client data and, with store_blobs, replace large strings with
+    blob references, storing each string once"""
+    if isinstance(value, str):
+        if store_blobs and len(value) >= BLOB_MIN_SIZE:
+            return {BLOB_REF_KEY: put_blob(value)}
+        return value
+    if isinstance(value, dict):
+        return {_escape_key(key): dedupe(item, store_blobs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [dedupe(item, store_blobs) for item in value]
+    return value
+
+
+def resolve(value):
+    """Replace blob references in value with the stored strings and unescape "$" keys"""
+    if isinstance(value, dict):
+        if len(value) == 1 and BLOB_REF_KEY in value:
+            return get_blob(value[BLOB_REF_KEY])
+        return {_unescape_key(key): resolve(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item) for item in value]
+    return value
+
+
+def has_blob_refs(encoded):
+    """Cheap check whether an encoded payload needs resolve(): blob references or escaped keys"""
+    return b'"' + ESCAPE_PREFIX.encode() in encoded
@@ -0,0 +1,98 @@
+"""
+Publish/subscribe channel for pushing changes to clients
+
+Writes publish small events (a new portfolio, a job status change) tagged with topics
+such as session_id, portfolio_id and job_id. Subscribers receive the events whose
+topics match their filters as Server-Sent Events. Recent events are kept in a ring
+buffer, so a client reconnecting with Last-Event-ID only receives what it missed.
+"""
+
+import os
+import asyncio
+from collections import deque
+from json_codec import dumps
+
+EVENT_HISTORY = int(os.getenv("EVENT_HISTORY", "1000"))
+# Events buffered per subscriber before a slow client is disconnected
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "100"))
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+
+class Subscription:
+    def __init__(self, filters):
+        self.filters = filters
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def matches(self, topics):
+        return all(topics.get(key) == value for key, value in self.filters.items())
+
+
+class EventBroker:
+    """In-process broker fanning events out to matching subscribers"""
+
+    def __init__(self, history=EVENT_HISTORY):
+        self._subscriptions = set()
+        self._history = deque(maxlen=history)  # (event_id, event, data, topics)
+        self._next_id = 1
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def publish(self, event, data, **topics):
+        """Send event with data to every subscriber whose filters match topics"""
+        topics = {key: value for key, value in topics.items() if value is not None}
+        message = (self._next_id, event, data, topics)
+        self._next_id += 1
+        self.published += 1
+        self._history.append(message)
+
+        for subscription in list(self._subscriptions):
+            if subscription.overflowed or not subscription.matches(topics):
+                continue
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # The client is not keeping up; end its stream, it resumes with Last-Event-ID
+                subscription.overflowed = True
+                self.dropped_subscribers += 1
+
+    def subscribe(self, last_event_id=None, **filters):
+        """Register a subscriber, replaying buffered events newer than last_event_id"""
+        subscription = Subscription({key: value for key, value in filters.items() if value is not None})
+        if last_event_id is not None:
+            for message in self._history:
+                if message[0] > last_event_id and subscription.matches(message[3]):
+                    if subscription.queue.full():
+                        break
+                    subscription.queue.put_nowait(message)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+
+    async def stream(self, request, subscription):
+        """Yield the subscription's events in SSE format until the client disconnects"""
+        try:
+            while not subscription.overflowed and not await request.is_disconnected():
+                try:
+                    event_id, event, data, _ = await asyncio.wait_for(
+                        subscription.queue.get(), timeout=KEEPALIVE_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event_id}\nevent: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def metrics(self):
+        return {
+            "subscribers": len(self._subscriptions),
+            "published": self.published,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+event_broker = EventBroker()
@@ -0,0 +1,131 @@
+"""
+HTTP caching helpers for portfolio reads
+
+- Strong ETags derived from the encoded response body, with the content-coding
+  appended for compressed responses so each representation has its own validator
+- If-None-Match handling that answers 304 Not Modified
+- gzip (or brotli, when the optional `brotli` package is installed) compression
+  for bodies above COMPRESSION_MIN_SIZE
+"""
+
+import gzip
+import hashlib
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed, compression would not pay off
+COMPRESSION_MIN_SIZE = 1024
+
+# Portfolios never change once written, so clients may cache them indefinitely
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Responses such as "latest" may change, clients must revalidate with the ETag
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Content-codings we produce, each gets its own ETag suffix
+CONTENT_CODINGS = ("br", "gzip")
+
+
+def compute_etag(body: bytes) -> str:
+    """Return a strong ETag for an encoded response body."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def encoded_etag(etag: str, encoding) -> str:
+    """ETag of one content-coding of a body, e.g. "<hash>-gzip" (RFC 9110 section 8.8.3.3)."""
+    if not encoding:
+        return etag
+    return etag[:-1] + "-" + encoding + '"'
+
+
+def _strip_encoding(tag: str) -> str:
+    for encoding in CONTENT_CODINGS:
+        suffix = "-" + encoding + '"'
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def etag_matches(request: Request, etag: str):
+    """Check the request's If-None-Match header against etag (weak comparison, RFC 9110).
+
+    Tags of any content-coding of the body match. Returns the matching tag to send
+    back with the 304, or None.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etag
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if _strip_encoding(tag) == etag:
+            return tag
+    return None
+
+
+def not_modified_response(etag: str, cache_control: str) -> Response:
+    """A 304 response carrying the validators the client needs."""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def _accepted_encodings(request: Request):
+    header = request.headers.get("accept-encoding", "")
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+def compress_body(request: Request, body: bytes, cache=None):
+    """Compress body for the client if it is large enough. Returns (body, content_encoding).
+
+    cache is an optional {encoding: bytes} dict for bodies that never change, so each
+    encoding is compressed once.
+    """
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return body, None
+
+    encodings = _accepted_encodings(request)
+    if brotli is not None and "br" in encodings:
+        encoding = "br"
+    elif "gzip" in encodings:
+        encoding = "gzip"
+    else:
+        return body, None
+
+    if cache is None:
+        return _compress(body, encoding), encoding
+    content = cache.get(encoding)
+    if content is None:
+        content = cache[encoding] = _compress(body, encoding)
+    return content, encoding
+
+
+def cached_json_response(request: Request, body: bytes, etag: str, cache_control: str,
+                         compressed=None) -> Response:
+    """Build a JSON response for pre-encoded body, honouring If-None-Match and Accept-Encoding.
+
+    compressed is an optional cache of compressed bodies, see compress_body.
+    """
+    matched = etag_matches(request, etag)
+    if matched:
+        return not_modified_response(matched, cache_control)
+
+    content, encoding = compress_body(request, body, compressed)
+    headers = {"ETag": encoded_etag(etag, encoding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="application/json", headers=headers)
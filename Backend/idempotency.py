@@ -0,0 +1,98 @@
+"""
+Idempotency-Key support for POST endpoints
+
+Clients and proxies retry POSTs on timeout. When a request carries an Idempotency-Key
+header, the first request runs normally and its result is kept for IDEMPOTENCY_TTL
+seconds. A retry with the same key gets that result back, or waits for the original
+request if it is still running, without calling upstream or writing again.
+
+Failed attempts (exceptions and success=False responses) are not kept, so a retry
+after a failure runs again.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+from fastapi import HTTPException
+from json_codec import dumps
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+
+def _is_failure(result):
+    if isinstance(result, dict):
+        return result.get("success") is False
+    return getattr(result, "success", None) is False
+
+
+class IdempotencyStore:
+    """In-memory TTL store of request results keyed by (scope, Idempotency-Key)"""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # (scope, key) -> (expires_at, request fingerprint, future holding the result)
+        self._entries = {}
+        self.replayed = 0
+
+    def _purge(self, now):
+        expired = [k for k, (expires_at, _, future) in self._entries.items()
+                   if expires_at <= now and future.done()]
+        for k in expired:
+            del self._entries[k]
+
+        # Still too many keys: drop the oldest finished ones
+        overflow = len(self._entries) - self.max_keys
+        if overflow > 0:
+            finished = sorted((expires_at, k) for k, (expires_at, _, future) in self._entries.items() if future.done())
+            for _, k in finished[:overflow]:
+                del self._entries[k]
+
+    async def run(self, scope, key, request_data, handler):
+        """Run handler() once per (scope, key). Returns (result, replayed)
+
+        request_data identifies the request body; reusing a key with a different
+        body is rejected with 422.
+        """
+        if not key:
+            return await handler(), False
+
+        now = time.monotonic()
+        self._purge(now)
+        fingerprint = hashlib.sha256(dumps(request_data)).hexdigest()
+        entry_key = (scope, key)
+
+        entry = self._entries.get(entry_key)
+        if entry is not None:
+            _, entry_fingerprint, future = entry
+            if entry_fingerprint != fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used with a different request body",
+                )
+            self.replayed += 1
+            # shield: a retry that disconnects must not cancel the original request
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[entry_key] = (now + self.ttl, fingerprint, future)
+        try:
+            result = await handler()
+        except BaseException as e:
+            self._entries.pop(entry_key, None)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # mark retrieved when nobody is waiting
+            raise
+
+        if _is_failure(result):
+            self._entries.pop(entry_key, None)
+        future.set_result(result)
+        return result, False
+
+
+idempotency_store = IdempotencyStore()
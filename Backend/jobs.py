@@ -0,0 +1,226 @@
+"""
+Asynchronous job queue for long-running requests
+
+A job is submitted with a kind and a JSON request, gets an ID straight away, and is
+run by a bounded pool of workers. Every state change is written to JOBS_DIR, so jobs
+that were queued or running when the server stopped are picked up again on startup.
+Clients poll a job by ID and can wait for it to finish, or are notified of every
+state change through the on_change callback.
+"""
+
+import os
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from json_codec import dump_file, load_file
+
+JOBS_DIR = "jobs"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+# Finished jobs older than this are deleted from disk
+JOB_RETENTION = timedelta(days=int(os.getenv("JOB_RETENTION_DAYS", "7")))
+# Finished jobs older than this are dropped from memory, later reads go to disk
+JOB_MEMORY_RETENTION = timedelta(seconds=int(os.getenv("JOB_MEMORY_RETENTION", "600")))
+# Seconds between purges of finished jobs
+JOB_PURGE_INTERVAL = int(os.getenv("JOB_PURGE_INTERVAL", "300"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobQueue:
+    """Bounded worker pool running registered job handlers, with jobs persisted to disk
+
+    handlers maps a job kind to an async function taking the job dict and
+    returning a JSON-serializable result. on_change, if given, is called with
+    the job dict after every persisted state change.
+    """
+
+    def __init__(self, handlers, on_change=None, directory=JOBS_DIR, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE):
+        self.handlers = handlers
+        self.on_change = on_change
+        self.directory = directory
+        self.workers = workers
+        self.queue_size = queue_size
+        self.jobs = {}  # job_id -> job dict
+        self._done_events = {}  # job_id -> asyncio.Event set when the job finishes
+        self._queue = None
+        self._tasks = []
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _save(self, job):
+        job["updated_at"] = datetime.now().isoformat()
+        path = self._path(job["job_id"])
+        tmp_path = f"{path}.tmp"
+        dump_file(job, tmp_path)
+        os.replace(tmp_path, path)
+        if self.on_change is not None:
+            self.on_change(job)
+
+    async def start(self):
+        """Load persisted jobs, re-queue unfinished ones and start the workers"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = asyncio.Queue()
+        cutoff = (datetime.now() - JOB_RETENTION).isoformat()
+        pending = []
+
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                job = load_file(path)
+            except Exception as e:
+                print(f"Error loading job file {filename}: {e}")
+                continue
+            if job["status"] in FINISHED:
+                # Finished jobs stay on disk only, get() reads them on demand
+                if job["updated_at"] < cutoff:
+                    os.remove(path)
+                continue
+            self.jobs[job["job_id"]] = job
+            self._done_events[job["job_id"]] = asyncio.Event()
+            pending.append(job)
+
+        # Jobs interrupted by a restart run again, oldest first
+        for job in sorted(pending, key=lambda j: j["created_at"]):
+            job["status"] = QUEUED
+            self._save(job)
+            self._queue.put_nowait(job["job_id"])
+        if pending:
+            print(f"Re-queued {len(pending)} unfinished jobs")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_periodically()))
+
+    def purge(self):
+        """Drop finished jobs from memory after JOB_MEMORY_RETENTION and from disk after JOB_RETENTION"""
+        now = datetime.now()
+        memory_cutoff = (now - JOB_MEMORY_RETENTION).isoformat()
+        disk_cutoff = (now - JOB_RETENTION).timestamp()
+
+        for job_id, job in list(self.jobs.items()):
+            if job["status"] in FINISHED and job["updated_at"] < memory_cutoff:
+                del self.jobs[job_id]
+                self._done_events.pop(job_id, None)
+
+        # Jobs not in memory are finished; every state change rewrites the file, so its
+        # modification time is the job's updated_at
+        for filename in os.listdir(self.directory):
+            job_id = filename[:-len(".json")]
+            if not filename.endswith(".json") or job_id in self.jobs:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                if os.path.getmtime(path) < disk_cutoff:
+                    os.remove(path)
+            except OSError as e:
+                print(f"Error purging job file {filename}: {e}")
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(JOB_PURGE_INTERVAL)
+            try:
+                self.purge()
+            except Exception as e:
+                print(f"Error purging jobs: {e}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind, request, session_id=None):
+        """Persist and enqueue a new job, returning the job dict"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue.qsize() >= self.queue_size:
+            raise HTTPException(
+                status_code=503,
+                detail="Job queue is full, please retry later",
+                headers={"Retry-After": "30"},
+            )
+
+        now = datetime.now().isoformat()
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "kind": kind,
+            "status": QUEUED,
+            "request": request,
+            "session_id": session_id,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.jobs[job["job_id"]] = job
+        self._done_events[job["job_id"]] = asyncio.Event()
+        self._save(job)
+        self._queue.put_nowait(job["job_id"])
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs[job_id]
+            try:
+                job["status"] = RUNNING
+                self._save(job)
+                job["result"] = await self.handlers[job["kind"]](job)
+                job["status"] = SUCCEEDED
+            except asyncio.CancelledError:
+                # Shutting down: the job stays "running" on disk and is re-queued on startup
+                raise
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                job["status"] = FAILED
+                job["error"] = str(e)
+            finally:
+                self._queue.task_done()
+
+            try:
+                self._save(job)
+            except Exception as e:
+                # The job keeps its in-memory state; a dead worker would shrink the pool for good
+                print(f"Error saving job {job_id}: {e}")
+            finally:
+                self._done_events[job_id].set()
+
+    def get(self, job_id):
+        """Return the job dict, reading finished jobs that were dropped from memory from disk"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            job_id = str(uuid.UUID(job_id))
+        except ValueError:
+            return None
+        try:
+            return load_file(self._path(job_id))
+        except FileNotFoundError:
+            return None
+
+    async def wait(self, job_id, timeout):
+        """Wait up to timeout seconds for a job to finish and return it"""
+        event = self._done_events.get(job_id)
+        if event is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.get(job_id)
+
+    def metrics(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "jobs": counts,
+        }
@@ -0,0 +1,43 @@
+"""
+JSON encoding used by the backend
+
+Uses orjson when it is installed and falls back to the standard library otherwise.
+Both backends produce compact UTF-8 bytes with keys in insertion order.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        """Encode obj as compact JSON bytes"""
+        return orjson.dumps(obj)
+
+    def loads(data):
+        """Decode JSON from bytes or str"""
+        return orjson.loads(data)
+else:
+    def dumps(obj) -> bytes:
+        """Encode obj as compact JSON bytes"""
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(data):
+        """Decode JSON from bytes or str"""
+        return json.loads(data)
+
+
+def dump_file(obj, path):
+    """Write obj to path as compact JSON"""
+    with open(path, "wb") as f:
+        f.write(dumps(obj))
+
+
+def load_file(path):
+    """Read and decode a JSON file"""
+    with open(path, "rb") as f:
+        return loads(f.read())
@@ -1,14 +1,34 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from portfolio_generator import generate_portfolios
 import uvicorn
+import asyncio
 import json
+import numpy as np
+from functools import lru_cache
 import requests
 import os
 import uuid
 from typing import Dict, Any, Optional, List
 from test_api import test_api_with_requests, test_api_with_curl
+from admission import rate_limit, toolhouse_limiter, gemini_limiter, admission_metrics
+from http_cache import (
+    etag_matches, not_modified_response, cached_json_response,
+    IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL,
+)
+from idempotency import idempotency_store
+from jobs import JobQueue
+from events import event_broker
+from json_codec import dumps, loads
+from rebalance import rebalance_accounts, build_account_matrices, parse_allocation
+from portfolio_generator import generate_portfolios, ASSET_CLASSES, GENERATORS, DEFAULT_GENERATOR
+from portfolio_store import (
+    portfolio_cache, save_portfolio, load_portfolio, latest_portfolio_id, list_summaries,
+    flatten_portfolio_data, portfolio_log, iter_stored_portfolios,
+)
+from portfolio_stats import portfolio_stats
 from datetime import datetime
 
 # Define models for the API
@@ -27,10 +47,20 @@ class ToolhouseData(BaseModel):
     investment_amount: str
     allocation: str
     response_json: Dict[str, Any]
-    
-class StoredPortfolio(BaseModel):
-    portfolio_id: str
-    portfolio_data: ToolhouseData
+
+class AccountHoldings(BaseModel):
+    account_id: str
+    # Target comes from the stored portfolio, or from an explicit allocation string
+    portfolio_id: Optional[str] = None
+    target_allocation: Optional[str] = None
+    holdings: Dict[str, float]
+    cash_flow: float = 0
+
+class RebalanceRequest(BaseModel):
+    accounts: List[AccountHoldings]
+    drift_threshold: float = 0.05
+    min_trade: float = 0
+    cash_only: bool = False
 
 app = FastAPI()
 
@@ -43,11 +73,103 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Queue for long-running requests submitted in job mode
+def publish_job(job):
+    """Push job status changes; the result is only included once the job has finished"""
+    event_broker.publish("job.updated", {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "error": job["error"],
+        "result": job["result"],
+    }, session_id=job.get("session_id"), job_id=job["job_id"])
+
+job_queue = JobQueue(
+    handlers={"generate-portfolio": lambda job: run_generate_portfolio_job(job)},
+    on_change=publish_job,
+)
+
+def publish_portfolio(event, portfolio_id, portfolio_data, session_id):
+    """Push a portfolio to subscribed clients (this replaces the shared Frontend/public/latest.json)"""
+    event_broker.publish(
+        event,
+        {"portfolio_id": portfolio_id, "portfolio_data": flatten_portfolio_data(portfolio_data)},
+        session_id=session_id,
+        portfolio_id=portfolio_id,
+    )
+
+# How often the portfolio log is checked for compaction, in seconds
+COMPACTION_INTERVAL = int(os.getenv("COMPACTION_INTERVAL", "3600"))
+
+async def compact_portfolio_log_periodically():
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL)
+        try:
+            await run_in_threadpool(portfolio_log.compact_if_needed)
+        except Exception as e:
+            print(f"Error compacting portfolio log: {e}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Aggregates are rebuilt before any job or request can write a portfolio
+    await run_in_threadpool(lambda: portfolio_stats.rebuild(iter_stored_portfolios()))
+    asyncio.create_task(compact_portfolio_log_periodically())
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await job_queue.stop()
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Admission control counters: rate limit rejections, queue depth and in-flight upstream calls"""
+    return {**admission_metrics(), "jobs": job_queue.metrics(), "events": event_broker.metrics()}
+
+@app.get("/api/stats")
+async def get_stats(request: Request):
+    """Portfolio counts, capital and allocation weights by risk level, name, day and week"""
+    body, etag = portfolio_stats.snapshot()
+    # Kept up to date on every write, so no store scan; unchanged stats revalidate to 304
+    return cached_json_response(request, body, etag, REVALIDATE_CACHE_CONTROL)
+
+@app.get("/api/events")
+async def subscribe_events(request: Request, session_id: Optional[str] = None, portfolio_id: Optional[str] = None,
+                           job_id: Optional[str] = None, last_event_id: Optional[int] = Header(None)):
+    """Server-Sent Events stream of new portfolios and job updates, optionally filtered"""
+    subscription = event_broker.subscribe(
+        last_event_id=last_event_id, session_id=session_id, portfolio_id=portfolio_id, job_id=job_id
+    )
+    return StreamingResponse(
+        event_broker.stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/portfolios")
-async def get_portfolios():
+async def get_portfolios(request: Request, generator: Optional[str] = None, seed: Optional[int] = None, constraints: Optional[str] = None):
+    """Generate a low, medium and high risk portfolio
+
+    generator is "gemini" or "local" (default from PORTFOLIO_GENERATOR). The local
+    generator takes a seed and constraints as JSON, e.g. {"Crypto": [0, 5]}.
+    """
+    generator = generator or DEFAULT_GENERATOR
+    try:
+        # The local generator has no upstream to protect and is used for load tests,
+        # so only the Gemini branch is rate limited
+        if generator == "local":
+            # Sampled in-process in microseconds, no upstream call to admit. New constraints
+            # first enumerate their valid allocations, which takes up to ~100ms, off the event loop
+            if not constraints:
+                return generate_portfolios("local", seed=seed)
+            return await run_in_threadpool(generate_portfolios, "local", seed=seed, constraints=loads(constraints))
+        if generator != "gemini":
+            raise ValueError(f"Unknown portfolio generator {generator!r}, expected one of {list(GENERATORS)}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid portfolio generator request: {str(e)}")
+
+    await rate_limit(request)
     try:
         # Ensure we're using Gemini to generate portfolios
-        portfolios = generate_portfolios()
+        portfolios = await gemini_limiter.run(generate_portfolios, "gemini")
         if not portfolios:
             raise HTTPException(status_code=500, detail="Failed to generate portfolios with Gemini")
         
@@ -55,6 +177,8 @@ async def get_portfolios():
         print(json.dumps(portfolios, indent=2))
         
         return portfolios
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating portfolios with Gemini: {e}")
         raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
@@ -73,27 +197,7 @@ class PortfolioRequest(BaseModel):
     portfolio_name: str
     risk_level: str
 
-# In-memory storage for portfolios
-stored_portfolios = {}
-
-# Function to save portfolio data to a file
-def save_portfolio_to_file(portfolio_id, portfolio_data):
-    try:
-        # Create a portfolios directory if it doesn't exist
-        os.makedirs('portfolios', exist_ok=True)
-        
-        # Save the portfolio data to a JSON file
-        file_path = f'portfolios/{portfolio_id}.json'
-        with open(file_path, 'w') as f:
-            json.dump(portfolio_data, f, indent=2)
-            
-        print(f"Portfolio saved to {file_path}")
-        return True
-    except Exception as e:
-        print(f"Error saving portfolio to file: {e}")
-        return False
-
-@app.post("/api/user-portfolio", response_model=PortfolioResponse)
+@app.post("/api/user-portfolio", response_model=PortfolioResponse, dependencies=[Depends(rate_limit)])
 async def create_user_portfolio(portfolio: UserPortfolio):
     try:
         # Extract data from the user's portfolio
@@ -134,7 +238,8 @@ async def create_user_portfolio(portfolio: UserPortfolio):
         
         try:
             # Make the POST request to the external API with SSL verification disabled
-            response = requests.post(
+            response = await toolhouse_limiter.run(
+                requests.post,
                 "https://agents.toolhouse.ai/aee55964-7c4e-4dad-80cf-568513e356bb",
                 json=payload,
                 headers={"Content-Type": "application/json"},
@@ -174,6 +279,8 @@ async def create_user_portfolio(portfolio: UserPortfolio):
                 data={"status_code": response.status_code, "response": response.text}
             )
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error processing user portfolio: {e}")
         return PortfolioResponse(
@@ -181,9 +288,22 @@ async def create_user_portfolio(portfolio: UserPortfolio):
             message=f"Error processing portfolio: {str(e)}"
         )
 
-@app.post("/api/test-api")
-async def test_api(portfolio_request: PortfolioRequest):
+async def run_idempotent(scope, idempotency_key, request_data, response, handler):
+    """Run handler once per Idempotency-Key, replaying the stored result on retries"""
+    result, replayed = await idempotency_store.run(scope, idempotency_key, request_data, handler)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+@app.post("/api/test-api", dependencies=[Depends(rate_limit)])
+async def test_api(portfolio_request: PortfolioRequest, response: Response, idempotency_key: Optional[str] = Header(None), x_session_id: Optional[str] = Header(None)):
     """Test the Toolhouse API with the provided portfolio data"""
+    return await run_idempotent(
+        "test-api", idempotency_key, portfolio_request.dict(), response,
+        lambda: run_test_api(portfolio_request, x_session_id)
+    )
+
+async def run_test_api(portfolio_request: PortfolioRequest, session_id: Optional[str] = None):
     try:
         # Extract values from the request
         investment_amount = portfolio_request.investment_amount
@@ -198,7 +318,8 @@ async def test_api(portfolio_request: PortfolioRequest):
         print(f"Risk Level: {risk_level}")
         
         # Try with requests first - pass all user data
-        requests_success, response_data = test_api_with_requests(
+        requests_success, response_data = await toolhouse_limiter.run(
+            test_api_with_requests,
             investment_amount=investment_amount, 
             allocation=allocation,
             portfolio_name=portfolio_name,
@@ -206,26 +327,14 @@ async def test_api(portfolio_request: PortfolioRequest):
         )
         
         if requests_success:
-            # Save to public/latest.json using absolute path
-            try:
-                frontend_public_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Frontend', 'public')
-                os.makedirs(frontend_public_dir, exist_ok=True)
-                latest_json_path = os.path.join(frontend_public_dir, 'latest.json')
-                
-                portfolio_data = {
-                    "portfolio_name": portfolio_name,
-                    "risk_level": risk_level,
-                    "investment_amount": investment_amount,
-                    "allocation": allocation,
-                    "response_json": response_data
-                }
-                
-                with open(latest_json_path, 'w') as f:
-                    json.dump(portfolio_data, f, indent=2)
-                    
-                print(f"Successfully saved test_api data to {latest_json_path}")
-            except Exception as e:
-                print(f"Error saving to latest.json: {e}")
+            # Push the result to subscribed clients
+            publish_portfolio("portfolio.preview", None, {
+                "portfolio_name": portfolio_name,
+                "risk_level": risk_level,
+                "investment_amount": investment_amount,
+                "allocation": allocation,
+                "response_json": response_data
+            }, session_id)
             return PortfolioResponse(
                 success=True,
                 message="API call successful using requests library",
@@ -239,7 +348,8 @@ async def test_api(portfolio_request: PortfolioRequest):
             )
         
         # If requests failed, try with curl - pass all user data
-        curl_success, curl_response_data = test_api_with_curl(
+        curl_success, curl_response_data = await toolhouse_limiter.run(
+            test_api_with_curl,
             investment_amount=investment_amount, 
             allocation=allocation,
             portfolio_name=portfolio_name,
@@ -247,26 +357,14 @@ async def test_api(portfolio_request: PortfolioRequest):
         )
         
         if curl_success:
-            # Save to public/latest.json using absolute path
-            try:
-                frontend_public_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Frontend', 'public')
-                os.makedirs(frontend_public_dir, exist_ok=True)
-                latest_json_path = os.path.join(frontend_public_dir, 'latest.json')
-                
-                portfolio_data = {
-                    "portfolio_name": portfolio_name,
-                    "risk_level": risk_level,
-                    "investment_amount": investment_amount,
-                    "allocation": allocation,
-                    "response_json": curl_response_data
-                }
-                
-                with open(latest_json_path, 'w') as f:
-                    json.dump(portfolio_data, f, indent=2)
-                    
-                print(f"Successfully saved test_api curl data to {latest_json_path}")
-            except Exception as e:
-                print(f"Error saving to latest.json: {e}")
+            # Push the result to subscribed clients
+            publish_portfolio("portfolio.preview", None, {
+                "portfolio_name": portfolio_name,
+                "risk_level": risk_level,
+                "investment_amount": investment_amount,
+                "allocation": allocation,
+                "response_json": curl_response_data
+            }, session_id)
             return PortfolioResponse(
                 success=True,
                 message="API call successful using curl command",
@@ -285,6 +383,8 @@ async def test_api(portfolio_request: PortfolioRequest):
             message="Failed to call Toolhouse API with both methods",
             data=None
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in test_api endpoint: {e}")
         return PortfolioResponse(
@@ -294,9 +394,52 @@ async def test_api(portfolio_request: PortfolioRequest):
         )
 
 
-@app.post("/api/generate-portfolio")
-async def generate_portfolio(portfolio_request: PortfolioRequest):
-    """Generate a portfolio based on user selections and store it in the backend"""
+@app.post("/api/generate-portfolio", dependencies=[Depends(rate_limit)])
+async def generate_portfolio(portfolio_request: PortfolioRequest, response: Response, idempotency_key: Optional[str] = Header(None), x_session_id: Optional[str] = Header(None), mode: str = "sync"):
+    """Generate a portfolio based on user selections and store it in the backend
+
+    With mode=job the request is queued and a job ID is returned immediately;
+    poll GET /api/jobs/{job_id} for the result.
+    """
+    if mode == "job":
+        response.status_code = 202
+        return await run_idempotent(
+            "generate-portfolio-job", idempotency_key, portfolio_request.dict(), response,
+            lambda: submit_generate_portfolio_job(portfolio_request, x_session_id)
+        )
+    return await run_idempotent(
+        "generate-portfolio", idempotency_key, portfolio_request.dict(), response,
+        lambda: run_generate_portfolio(portfolio_request, x_session_id)
+    )
+
+async def submit_generate_portfolio_job(portfolio_request: PortfolioRequest, session_id: Optional[str] = None):
+    job = job_queue.submit("generate-portfolio", portfolio_request.dict(), session_id=session_id)
+    return {
+        "success": True,
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/api/jobs/{job['job_id']}"
+    }
+
+async def run_generate_portfolio_job(job):
+    """Job handler: generate and store a portfolio, failing the job if generation fails"""
+    result = await run_generate_portfolio(PortfolioRequest(**job["request"]), job.get("session_id"))
+    if not result.success:
+        raise RuntimeError(result.message)
+    return result.dict()
+
+# Maximum time a GET /api/jobs/{job_id} request may wait for the job to finish
+JOB_MAX_WAIT = 60
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Get a job's status and result; with wait > 0, wait up to that many seconds for it to finish"""
+    job = await job_queue.wait(job_id, min(wait, JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job with ID {job_id} not found")
+    return job
+
+async def run_generate_portfolio(portfolio_request: PortfolioRequest, session_id: Optional[str] = None):
     try:
         # Extract values from the request
         investment_amount = portfolio_request.investment_amount
@@ -322,7 +465,8 @@ async def generate_portfolio(portfolio_request: PortfolioRequest):
         print(f"Allocation: {allocation}")
         
         # Call the Toolhouse API using the test_api_with_requests function
-        api_success, api_response = test_api_with_requests(
+        api_success, api_response = await toolhouse_limiter.run(
+            test_api_with_requests,
             investment_amount=investment_amount,
             allocation=allocation,
             portfolio_name=portfolio_name,
@@ -331,7 +475,8 @@ async def generate_portfolio(portfolio_request: PortfolioRequest):
         
         if not api_success:
             # Try with curl as fallback
-            api_success, api_response = test_api_with_curl(
+            api_success, api_response = await toolhouse_limiter.run(
+                test_api_with_curl,
                 investment_amount=investment_amount,
                 allocation=allocation,
                 portfolio_name=portfolio_name,
@@ -354,27 +499,10 @@ async def generate_portfolio(portfolio_request: PortfolioRequest):
             "response_json": api_response
         }
         
-        # Store the portfolio data
+        # Store the portfolio data, encoded once for memory and disk
         portfolio_id = str(uuid.uuid4())
-        stored_portfolios[portfolio_id] = StoredPortfolio(
-            portfolio_id=portfolio_id,
-            portfolio_data=ToolhouseData(**portfolio_data)
-        )
-        
-        # Also save to file for persistence
-        save_portfolio_to_file(portfolio_id, portfolio_data)
-        # Also save as latest.json for frontend using absolute path
-        try:
-            frontend_public_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Frontend', 'public')
-            os.makedirs(frontend_public_dir, exist_ok=True)
-            latest_json_path = os.path.join(frontend_public_dir, 'latest.json')
-            
-            with open(latest_json_path, 'w') as f:
-                json.dump(portfolio_data, f, indent=2)
-                
-            print(f"Successfully saved generate_portfolio data to {latest_json_path}")
-        except Exception as e:
-            print(f"Error saving to latest.json: {e}")
+        await run_in_threadpool(save_portfolio, portfolio_id, ToolhouseData(**portfolio_data).dict())
+        publish_portfolio("portfolio.created", portfolio_id, portfolio_data, session_id)
         
         return PortfolioResponse(
             success=True,
@@ -388,6 +516,8 @@ async def generate_portfolio(portfolio_request: PortfolioRequest):
                 "response_json": api_response
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating portfolio: {e}")
         return PortfolioResponse(
@@ -395,173 +525,118 @@ async def generate_portfolio(portfolio_request: PortfolioRequest):
             message=f"Error running test API: {str(e)}"
         )
 
-# In-memory storage for portfolios (in a real app, use a database)
-# Structure: {portfolio_id: StoredPortfolio}
-# This is already defined above: stored_portfolios = {}
-
-# Ensure data directory exists
-DATA_DIR = "./data"
-os.makedirs(DATA_DIR, exist_ok=True)
-
 @app.post("/api/portfolios/store")
-async def store_portfolio(data: ToolhouseData):
+async def store_portfolio(data: ToolhouseData, response: Response, idempotency_key: Optional[str] = Header(None), x_session_id: Optional[str] = Header(None)):
+    return await run_idempotent(
+        "portfolios-store", idempotency_key, data.dict(), response,
+        lambda: run_store_portfolio(data, x_session_id)
+    )
+
+async def run_store_portfolio(data: ToolhouseData, session_id: Optional[str] = None):
     try:
         # Generate a unique ID
-        portfolio_id = f"portfolio_{datetime.now().strftime('%Y%m%d%H%M%S')}_{len(stored_portfolios)}"
+        # Random suffix: concurrent stores in the same second must not share an ID
+        portfolio_id = f"portfolio_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:12]}"
         
-        # Create a stored portfolio object
-        stored_portfolio = StoredPortfolio(
-            portfolio_id=portfolio_id,
-            portfolio_data=data
-        )
-        
-        # Store in memory
-        stored_portfolios[portfolio_id] = stored_portfolio
-        
-        # Also save to a JSON file for persistence
-        with open(f"{DATA_DIR}/{portfolio_id}.json", "w") as f:
-            json.dump(stored_portfolio.dict(), f, indent=2)
-        # Also save to Frontend/public/latest.json using absolute path
-        try:
-            frontend_public_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Frontend', 'public')
-            os.makedirs(frontend_public_dir, exist_ok=True)
-            latest_json_path = os.path.join(frontend_public_dir, 'latest.json')
-            
-            with open(latest_json_path, 'w') as f_latest:
-                json.dump(stored_portfolio.portfolio_data.dict(), f_latest, indent=2)
-                
-            print(f"Successfully saved store_portfolio data to {latest_json_path}")
-        except Exception as e:
-            print(f"Error saving to latest.json: {e}")
+        # Encode once, then keep the same bytes in memory and on disk; the log append
+        # fsyncs and may wait for a compaction, so it runs off the event loop
+        portfolio_data = data.dict()
+        await run_in_threadpool(save_portfolio, portfolio_id, portfolio_data)
+        publish_portfolio("portfolio.created", portfolio_id, portfolio_data, session_id)
         
         return {"success": True, "portfolio_id": portfolio_id}
     except Exception as e:
         print(f"Error storing portfolio: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to store portfolio: {str(e)}")
 
-@app.get("/api/portfolios/{portfolio_id}")
-async def get_portfolio(portfolio_id: str):
-    # Try to get from memory first
-    if portfolio_id in stored_portfolios:
-        return stored_portfolios[portfolio_id]
-    
-    # Try to get from portfolios directory (from generate-portfolio endpoint)
-    try:
-        file_path = f"portfolios/{portfolio_id}.json"
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                # Create a StoredPortfolio object
-                portfolio_data = ToolhouseData(**data)
-                stored_portfolio = StoredPortfolio(
-                    portfolio_id=portfolio_id,
-                    portfolio_data=portfolio_data
-                )
-                # Store in memory for future requests
-                stored_portfolios[portfolio_id] = stored_portfolio
-                return stored_portfolio
-    except Exception as e:
-        print(f"Error loading from portfolios directory: {e}")
-    
-    # If not found in portfolios directory, try the DATA_DIR
-    try:
-        file_path = f"{DATA_DIR}/{portfolio_id}.json"
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                # Store in memory for future requests
-                stored_portfolios[portfolio_id] = StoredPortfolio(**data)
-                return data
-        else:
-            raise HTTPException(status_code=404, detail=f"Portfolio with ID {portfolio_id} not found")
-    except Exception as e:
-        print(f"Error retrieving portfolio: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to retrieve portfolio: {str(e)}")
-
 @app.get("/api/portfolios/latest")
-async def get_latest_portfolio():
+async def get_latest_portfolio(request: Request):
     """Get the most recently created portfolio"""
     try:
-        # Check stored_portfolios first
-        if stored_portfolios:
-            # Find the most recent portfolio based on ID (which contains timestamp)
-            latest_portfolio_id = sorted(stored_portfolios.keys(), reverse=True)[0]
-            return stored_portfolios[latest_portfolio_id]
-        
-        # If no portfolios in memory, check the portfolios directory
-        if os.path.exists('portfolios'):
-            portfolio_files = [f for f in os.listdir('portfolios') if f.endswith('.json')]
-            if portfolio_files:
-                # Sort by modification time (most recent first)
-                latest_file = sorted(portfolio_files, key=lambda x: os.path.getmtime(os.path.join('portfolios', x)), reverse=True)[0]
-                portfolio_id = latest_file.replace('.json', '')
-                
-                with open(os.path.join('portfolios', latest_file), 'r') as f:
-                    data = json.load(f)
-                    # Create a StoredPortfolio object
-                    portfolio_data = ToolhouseData(**data)
-                    stored_portfolio = StoredPortfolio(
-                        portfolio_id=portfolio_id,
-                        portfolio_data=portfolio_data
-                    )
-                    # Store in memory for future requests
-                    stored_portfolios[portfolio_id] = stored_portfolio
-                    return stored_portfolio
-        
-        # If no portfolios in the portfolios directory, check the DATA_DIR
-        if os.path.exists(DATA_DIR):
-            portfolio_files = [f for f in os.listdir(DATA_DIR) if f.endswith('.json')]
-            if portfolio_files:
-                # Sort by modification time (most recent first)
-                latest_file = sorted(portfolio_files, key=lambda x: os.path.getmtime(os.path.join(DATA_DIR, x)), reverse=True)[0]
-                
-                with open(os.path.join(DATA_DIR, latest_file), 'r') as f:
-                    data = json.load(f)
-                    return data
+        portfolio_id = await run_in_threadpool(latest_portfolio_id)
+        portfolio = await run_in_threadpool(load_portfolio, portfolio_id) if portfolio_id else None
+        if portfolio is None:
+            # No portfolios found
+            raise HTTPException(status_code=404, detail="No portfolios found")
         
-        # No portfolios found
-        raise HTTPException(status_code=404, detail="No portfolios found")
+        # The latest portfolio can change, so clients revalidate against its ETag
+        body = await run_in_threadpool(lambda: portfolio.body)
+        return cached_json_response(request, body, portfolio.etag, REVALIDATE_CACHE_CONTROL,
+                                    portfolio.compressed)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting latest portfolio: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get latest portfolio: {str(e)}")
 
 @app.get("/api/portfolios/list")
 async def list_portfolios():
-    # List all portfolios (both in memory and from files)
-    portfolios = []
-    
-    # Add in-memory portfolios
-    for portfolio_id, portfolio in stored_portfolios.items():
-        portfolios.append({
-            "id": portfolio_id,
-            "portfolio_name": portfolio.portfolio_data.portfolio_name,
-            "risk_level": portfolio.portfolio_data.risk_level,
-            "investment_amount": portfolio.portfolio_data.investment_amount
-        })
-    
-    # Add portfolios from files that aren't in memory
-    if os.path.exists(DATA_DIR):
-        for filename in os.listdir(DATA_DIR):
-            if filename.endswith(".json"):
-                portfolio_id = filename.replace(".json", "")
-                if portfolio_id not in stored_portfolios:
-                    try:
-                        with open(f"{DATA_DIR}/{filename}", "r") as f:
-                            data = json.load(f)
-                            portfolios.append({
-                                "id": data["id"],
-                                "created_at": data["created_at"],
-                                "portfolio_name": data["portfolio_data"]["portfolio_name"],
-                                "risk_level": data["portfolio_data"]["risk_level"],
-                                "investment_amount": data["portfolio_data"]["investment_amount"]
-                            })
-                    except Exception as e:
-                        print(f"Error reading portfolio file {filename}: {e}")
+    # List all portfolios (both in memory and from files), newest first
+    return {"portfolios": await run_in_threadpool(list_summaries)}
+
+@app.get("/api/portfolios/{portfolio_id}")
+async def get_portfolio(portfolio_id: str, request: Request):
+    # Portfolios are immutable, so a cached ETag answers revalidation without touching the body
+    cached = portfolio_cache.get(portfolio_id)
+    matched = etag_matches(request, cached.etag) if cached is not None else None
+    if matched:
+        return not_modified_response(matched, IMMUTABLE_CACHE_CONTROL)
     
-    # Sort by creation date (newest first)
-    portfolios.sort(key=lambda x: x["created_at"], reverse=True)
+    try:
+        portfolio = await run_in_threadpool(load_portfolio, portfolio_id)
+        if portfolio is None:
+            raise HTTPException(status_code=404, detail=f"Portfolio with ID {portfolio_id} not found")
+        # Resolving blob references reads from disk the first time
+        body = await run_in_threadpool(lambda: portfolio.body)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error retrieving portfolio: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve portfolio: {str(e)}")
     
-    return {"portfolios": portfolios}
+    # Return the bytes encoded at write time, without re-validating or re-encoding
+    # Compressed once per content-coding and kept with the cached portfolio
+    return cached_json_response(request, body, portfolio.etag, IMMUTABLE_CACHE_CONTROL,
+                                portfolio.compressed)
+
+@lru_cache(maxsize=4096)
+def portfolio_targets(portfolio_id):
+    """Target weights of a stored portfolio (portfolios never change, so this is cached)"""
+    portfolio = load_portfolio(portfolio_id)
+    if portfolio is None:
+        raise HTTPException(status_code=404, detail=f"Portfolio with ID {portfolio_id} not found")
+    return parse_allocation(loads(portfolio.stored)["portfolio_data"]["allocation"])
+
+@app.post("/api/rebalance/batch")
+def rebalance_batch(rebalance_request: RebalanceRequest):
+    """Compute the trades that bring many accounts back to their portfolio's target allocation
+
+    Trades are amounts per asset class, positive to buy and negative to sell. This is a
+    plain def, so FastAPI runs the per-account loop and store reads in the threadpool.
+    """
+    accounts = rebalance_request.accounts
+    try:
+        holdings, targets, cash_flows = build_account_matrices(accounts, portfolio_targets)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    trades, max_drift = rebalance_accounts(
+        holdings, targets, cash_flows,
+        drift_threshold=rebalance_request.drift_threshold,
+        min_trade=rebalance_request.min_trade,
+        cash_only=rebalance_request.cash_only,
+    )
+
+    # Column-oriented response: row i of trades belongs to account_ids[i], columns follow
+    # asset_classes. Encoded directly, the generic response encoder dominates for large batches
+    trades = np.round(trades, 2)
+    return Response(content=dumps({
+        "asset_classes": ASSET_CLASSES,
+        "account_ids": [account.account_id for account in accounts],
+        "rebalance": trades.any(axis=1).tolist(),
+        "max_drift": np.round(max_drift, 4).tolist(),
+        "trades": trades.tolist(),
+    }), media_type="application/json")
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -4,10 +4,18 @@ Portfolio Generator using Google's Gemini AI
 
 This script generates three investment portfolios (low, medium, and high risk)
 using Google's Gemini AI model.
+
+A local generator is also available. It samples allocations within per-risk-level
+bounds from a seeded random generator, needs no API key or network access, and is
+selected with generator="local" or PORTFOLIO_GENERATOR=local.
 """
 
 import os
+import sys
 import json
+import argparse
+import numpy as np
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 import google.generativeai as genai
@@ -15,15 +23,83 @@ import google.generativeai as genai
 # Load environment variables from .env.local file
 load_dotenv(Path(__file__).parent / ".env.local")
 
-# Configure the Gemini API with your API key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables. Please create a .env.local file with your API key.")
+# Generator used when the caller does not choose one: "gemini" or "local"
+GENERATORS = ("gemini", "local")
+DEFAULT_GENERATOR = os.getenv("PORTFOLIO_GENERATOR", "gemini")
+
+_model = None
+
 
-genai.configure(api_key=GEMINI_API_KEY)
+def get_model():
+    """Configure the Gemini API on first use, so the local generator works without a key."""
+    global _model
+    if _model is None:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables. Please create a .env.local file with your API key.")
+        genai.configure(api_key=api_key)
+        _model = genai.GenerativeModel('gemini-2.0-flash')
+    return _model
 
+# Asset classes and risk levels every generated portfolio set must cover
+ASSET_CLASSES = ["Stocks", "Bonds", "Cash", "Crypto", "ETF"]
+RISK_LEVELS = {
+    "low": "Low Risk Portfolio",
+    "medium": "Medium Risk Portfolio",
+    "high": "High Risk Portfolio",
+}
+
+# Structured-output schema for one portfolio set (same shape as generate_portfolios)
+PORTFOLIO_SET_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "portfolios": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "enum": list(RISK_LEVELS.values())},
+                    "risk_level": {"type": "string", "enum": list(RISK_LEVELS.keys())},
+                    "asset_allocation": {
+                        "type": "object",
+                        "properties": {asset: {"type": "number"} for asset in ASSET_CLASSES},
+                        "required": ASSET_CLASSES,
+                    },
+                },
+                "required": ["name", "risk_level", "asset_allocation"],
+            },
+        }
+    },
+    "required": ["portfolios"],
+}
 
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Schema for a batch response holding several independent portfolio sets
+BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "portfolio_sets": {"type": "array", "items": PORTFOLIO_SET_SCHEMA}
+    },
+    "required": ["portfolio_sets"],
+}
+
+BATCH_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=BATCH_RESPONSE_SCHEMA,
+)
+
+# Allowed rounding error when checking that an allocation adds up to 100%
+ALLOCATION_TOLERANCE = 0.5
+
+# Whole-percentage (min, max) bounds per asset class used by the local generator
+RISK_BOUNDS = {
+    "low": {"Stocks": (15, 40), "Bonds": (35, 60), "Cash": (10, 30), "Crypto": (0, 3), "ETF": (0, 15)},
+    "medium": {"Stocks": (35, 60), "Bonds": (15, 40), "Cash": (0, 15), "Crypto": (0, 10), "ETF": (5, 20)},
+    "high": {"Stocks": (50, 80), "Bonds": (0, 20), "Cash": (0, 10), "Crypto": (5, 25), "ETF": (0, 15)},
+}
+# Portfolio sets sampled per call when the local generator streams many sets
+LOCAL_BATCH_SIZE = 1000
+# Most partial allocations enumerate_allocations builds for one risk level (5 bytes each)
+MAX_ENUMERATED_ALLOCATIONS = 5_000_000
 
 
 def get_sample_portfolios():
@@ -37,7 +113,7 @@ def get_sample_portfolios():
                     "Stocks": 30,
                     "Bonds": 50,
                     "Cash": 15,
-                    "Crypto": 199383883830,
+                    "Crypto": 0,
                     "ETF": 5
                 }
             },
@@ -67,7 +143,21 @@ def get_sample_portfolios():
     }
 
 
-def generate_portfolios():
+def generate_portfolios(generator=None, seed=None, constraints=None):
+    """Generate three investment portfolios based on risk levels.
+
+    generator is "gemini" (the default unless PORTFOLIO_GENERATOR says otherwise)
+    or "local"; seed and constraints only apply to the local generator.
+    """
+    generator = generator or DEFAULT_GENERATOR
+    if generator == "local":
+        return generate_local_portfolios(seed=seed, constraints=constraints)
+    if generator != "gemini":
+        raise ValueError(f"Unknown portfolio generator {generator!r}, expected one of {GENERATORS}")
+    return generate_gemini_portfolios()
+
+
+def generate_gemini_portfolios():
     """Generate three investment portfolios based on risk levels using Gemini AI."""
     
     prompt = """
@@ -106,7 +196,7 @@ Ensure the asset allocation of each individual portfolio (low, medium, high) cha
     """
     
     try:
-        response = model.generate_content(prompt)
+        response = get_model().generate_content(prompt)
         
         # Extract JSON from the response
         response_text = response.text
@@ -126,6 +216,221 @@ Ensure the asset allocation of each individual portfolio (low, medium, high) cha
         print(f"Error generating portfolios with Gemini API: {e}")
         return None
 
+def validate_portfolio_set(portfolio_set):
+    """Check a single portfolio set and return an error message, or None if it is valid."""
+    if not isinstance(portfolio_set, dict) or not isinstance(portfolio_set.get("portfolios"), list):
+        return "missing 'portfolios' list"
+
+    portfolios = portfolio_set["portfolios"]
+    if not all(isinstance(p, dict) for p in portfolios):
+        return "every portfolio must be an object"
+    risk_levels = sorted(str(p.get("risk_level")) for p in portfolios)
+    if risk_levels != sorted(RISK_LEVELS):
+        return f"expected one portfolio per risk level, got {risk_levels}"
+
+    for portfolio in portfolios:
+        risk_level = portfolio["risk_level"]
+        if portfolio.get("name") != RISK_LEVELS[risk_level]:
+            return f"unexpected name {portfolio.get('name')!r} for {risk_level} risk"
+
+        allocation = portfolio.get("asset_allocation")
+        if not isinstance(allocation, dict) or sorted(allocation) != sorted(ASSET_CLASSES):
+            return f"{risk_level} risk allocation must cover exactly {ASSET_CLASSES}"
+
+        values = list(allocation.values())
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0 for v in values):
+            return f"{risk_level} risk allocation has non-numeric or negative weights"
+        if abs(sum(values) - 100) > ALLOCATION_TOLERANCE:
+            return f"{risk_level} risk allocation adds up to {sum(values)}%, not 100%"
+
+    return None
+
+
+def build_batch_prompt(set_count):
+    """Build the prompt asking Gemini for several independent portfolio sets at once."""
+    return f"""
+    Generate {set_count} independent sets of simple investment portfolios.
+
+    Each set contains exactly three portfolios, one per risk level: low, medium and high.
+    The names must be exactly: "Low Risk Portfolio", "Medium Risk Portfolio" and "High Risk Portfolio".
+    Each portfolio gives asset allocation percentages across: {", ".join(ASSET_CLASSES)}.
+
+    Ensure the percentages of every portfolio add up to 100%.
+    Ensure the allocations differ between sets, so every set is a distinct alternative.
+    Return the sets in the "portfolio_sets" array.
+    """
+
+
+def generate_portfolio_batch(set_count, max_attempts=3):
+    """Generate set_count portfolio sets, amortizing the Gemini calls across the batch.
+
+    Every set in a reply is validated on its own; valid sets are kept and only
+    the missing ones are requested again, up to max_attempts calls in total.
+    Returns the list of valid sets, which may be shorter than set_count.
+    """
+    portfolio_sets = []
+    for attempt in range(1, max_attempts + 1):
+        missing = set_count - len(portfolio_sets)
+        if missing <= 0:
+            break
+
+        try:
+            response = get_model().generate_content(
+                build_batch_prompt(missing),
+                generation_config=BATCH_GENERATION_CONFIG,
+            )
+            candidates = json.loads(response.text).get("portfolio_sets", [])
+        except Exception as e:
+            print(f"Error generating portfolio batch with Gemini API (attempt {attempt}): {e}")
+            continue
+        if not isinstance(candidates, list):
+            print(f"Discarding batch without a 'portfolio_sets' list (attempt {attempt})")
+            continue
+
+        for portfolio_set in candidates[:missing]:
+            error = validate_portfolio_set(portfolio_set)
+            if error:
+                print(f"Discarding invalid portfolio set: {error}")
+            else:
+                portfolio_sets.append(portfolio_set)
+
+    return portfolio_sets
+
+
+def allocation_bounds(risk_level, constraints=None):
+    """Return (lower, upper) whole-percentage arrays over ASSET_CLASSES for a risk level.
+
+    constraints maps an asset class to a (min, max) percentage that applies to every
+    risk level. It narrows the risk level's bounds, and replaces them where the two
+    do not overlap. A ValueError is raised when no allocation can satisfy the result.
+    """
+    bounds = RISK_BOUNDS[risk_level]
+    lower = np.array([bounds[asset][0] for asset in ASSET_CLASSES])
+    upper = np.array([bounds[asset][1] for asset in ASSET_CLASSES])
+
+    for asset, (minimum, maximum) in (constraints or {}).items():
+        if asset not in ASSET_CLASSES:
+            raise ValueError(f"Unknown asset class {asset!r} in constraints, expected one of {ASSET_CLASSES}")
+        minimum, maximum = int(np.ceil(minimum)), int(np.floor(maximum))
+        if not 0 <= minimum <= maximum <= 100:
+            raise ValueError(f"Invalid constraint ({minimum}, {maximum}) for {asset}")
+        column = ASSET_CLASSES.index(asset)
+        if max(lower[column], minimum) <= min(upper[column], maximum):
+            lower[column], upper[column] = max(lower[column], minimum), min(upper[column], maximum)
+        else:
+            lower[column], upper[column] = minimum, maximum
+
+    if lower.sum() > 100 or upper.sum() < 100:
+        raise ValueError(f"Constraints {constraints} leave no valid {risk_level} risk allocation")
+    return lower, upper
+
+
+def enumerate_allocations(lower, upper):
+    """Every whole-percentage allocation within (lower, upper) that adds up to 100, one per row."""
+    # Least and most the asset classes after each column can still add
+    rest_min = np.append(np.cumsum(lower[::-1])[::-1][1:], 0)
+    rest_max = np.append(np.cumsum(upper[::-1])[::-1][1:], 0)
+
+    allocations = np.zeros((1, 0), dtype=np.uint8)
+    for column in range(len(lower)):
+        values = np.arange(lower[column], upper[column] + 1, dtype=np.uint8)
+        if len(allocations) * len(values) > MAX_ENUMERATED_ALLOCATIONS:
+            raise ValueError("Bounds are too wide to enumerate, narrow the constraints")
+        allocations = np.hstack([
+            np.repeat(allocations, len(values), axis=0),
+            np.tile(values, len(allocations))[:, None],
+        ])
+        # Drop partial allocations that can no longer reach exactly 100
+        totals = allocations.sum(axis=1)
+        allocations = allocations[(totals + rest_min[column] <= 100) & (totals + rest_max[column] >= 100)]
+    return allocations
+
+
+@lru_cache(maxsize=16)
+def _allocation_tables(constraint_items):
+    """All valid allocations of every risk level, stacked, with each level's offset and size."""
+    constraints = dict(constraint_items)
+    tables = [enumerate_allocations(*allocation_bounds(risk_level, constraints)) for risk_level in RISK_LEVELS]
+    sizes = np.array([len(table) for table in tables])
+    offsets = np.cumsum(sizes) - sizes
+    return np.concatenate(tables), offsets, sizes
+
+
+def sample_portfolio_sets(count, rng, constraints=None):
+    """Sample count portfolio sets as a (count, risk levels, assets) array of percentages.
+
+    Allocations are drawn uniformly from every valid whole-percentage allocation of
+    each risk level, enumerated once per set of constraints, so sampling is a single
+    random index and lookup per portfolio.
+    """
+    try:
+        # Whole percentages, so constraints that differ only in fractions share a table
+        constraint_items = tuple(sorted(
+            (asset, (int(np.ceil(float(minimum))), int(np.floor(float(maximum)))))
+            for asset, (minimum, maximum) in (constraints or {}).items()
+        ))
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f"Constraints must map asset classes to [min, max] percentages, got {constraints!r}")
+    table, offsets, sizes = _allocation_tables(constraint_items)
+    return table[offsets + rng.integers(sizes, size=(count, len(sizes)))]
+
+
+def portfolio_set_from_allocations(allocations):
+    """Turn one (risk levels, assets) array into the generate_portfolios response shape."""
+    return {
+        "portfolios": [
+            {
+                "name": name,
+                "risk_level": risk_level,
+                "asset_allocation": dict(zip(ASSET_CLASSES, row)),
+            }
+            for (risk_level, name), row in zip(RISK_LEVELS.items(), allocations.tolist())
+        ]
+    }
+
+
+def generate_local_portfolios(seed=None, constraints=None):
+    """Generate three portfolios locally; the same seed and constraints give the same portfolios."""
+    rng = np.random.default_rng(seed)
+    return portfolio_set_from_allocations(sample_portfolio_sets(1, rng, constraints)[0])
+
+
+def stream_local_portfolio_sets(total, seed=None, constraints=None, batch_size=LOCAL_BATCH_SIZE):
+    """Yield total locally generated portfolio sets, sampled batch_size at a time."""
+    rng = np.random.default_rng(seed)
+    produced = 0
+    while produced < total:
+        count = min(batch_size, total - produced)
+        for allocations in sample_portfolio_sets(count, rng, constraints):
+            yield portfolio_set_from_allocations(allocations)
+        produced += count
+
+
+def stream_portfolio_sets(total, batch_size):
+    """Yield total portfolio sets, requesting them from Gemini batch_size at a time."""
+    produced = 0
+    while produced < total:
+        batch = generate_portfolio_batch(min(batch_size, total - produced))
+        if not batch:
+            print("Gemini returned no valid portfolio sets, stopping early")
+            return
+        for portfolio_set in batch:
+            produced += 1
+            yield portfolio_set
+
+
+def save_portfolio_sets_to_jsonl(portfolio_sets, filename):
+    """Write portfolio sets to a JSONL file as they arrive, one set per line."""
+    count = 0
+    with open(filename, 'w') as f:
+        for portfolio_set in portfolio_sets:
+            f.write(json.dumps(portfolio_set) + "\n")
+            f.flush()
+            count += 1
+    print(f"\n{count} portfolio sets saved to {filename}")
+    return count
+
+
 def display_portfolio(portfolio):
     """Display a single portfolio in a formatted way."""
     print(f"\n{'=' * 80}")
@@ -152,11 +457,32 @@ def save_portfolios_to_file(portfolios_data, filename="generated_portfolios.json
         print(f"Error saving portfolios to file: {e}")
 
 def main():
-    print("Generating investment portfolios using Gemini AI...\n")
-    portfolios_data = generate_portfolios()
+    parser = argparse.ArgumentParser(description='Generate investment portfolios with Gemini AI')
+    parser.add_argument('--count', type=int, help='Number of portfolio sets to generate in batch mode')
+    parser.add_argument('--batch-size', type=int, default=10, help='Portfolio sets requested per Gemini call')
+    parser.add_argument('--output', type=str, default='generated_portfolios.jsonl', help='JSONL file for batch mode')
+    parser.add_argument('--generator', choices=GENERATORS, default=DEFAULT_GENERATOR, help='Use Gemini or the local generator')
+    parser.add_argument('--seed', type=int, help='Random seed for the local generator')
+    args = parser.parse_args()
+    source = "the local generator" if args.generator == "local" else "Gemini AI"
+
+    if args.count:
+        if args.generator == "local":
+            print(f"Generating {args.count} portfolio sets using {source}...\n")
+            portfolio_sets = stream_local_portfolio_sets(args.count, args.seed)
+        else:
+            print(f"Generating {args.count} portfolio sets using {source}, {args.batch_size} per call...\n")
+            portfolio_sets = stream_portfolio_sets(args.count, args.batch_size)
+        saved = save_portfolio_sets_to_jsonl(portfolio_sets, args.output)
+        if saved < args.count:
+            sys.exit(1)
+        return
+
+    print(f"Generating investment portfolios using {source}...\n")
+    portfolios_data = generate_portfolios(args.generator, seed=args.seed)
     
     if portfolios_data and 'portfolios' in portfolios_data:
-        print(f"Successfully generated {len(portfolios_data['portfolios'])} investment portfolios with Gemini AI!")
+        print(f"Successfully generated {len(portfolios_data['portfolios'])} investment portfolios with {source}!")
         
         # Display each portfolio
         for portfolio in portfolios_data['portfolios']:
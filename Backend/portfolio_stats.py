@@ -0,0 +1,163 @@
+"""
+Incrementally maintained aggregates over stored portfolios
+
+Every portfolio written through save_portfolio is added to running totals, grouped
+by risk level, portfolio name, day and ISO week: portfolio count, invested capital,
+capital per asset class, average allocation weights and a histogram of each asset
+class's weight. The totals are rebuilt from the store once on startup, so serving
+them never scans or decodes stored portfolios.
+
+The encoded snapshot is cached until the next write, so repeated reads between
+writes return the same bytes and ETag.
+"""
+
+import re
+import threading
+from datetime import datetime
+from json_codec import dumps
+from http_cache import compute_etag
+from rebalance import parse_allocation
+from portfolio_generator import ASSET_CLASSES
+
+# Weight histograms use buckets of this many percentage points; 100% falls in the last one
+HISTOGRAM_BUCKET_WIDTH = 10
+HISTOGRAM_BUCKETS = 100 // HISTOGRAM_BUCKET_WIDTH
+
+AMOUNT_PATTERN = re.compile(r"[^\d.\-]")
+
+
+def parse_amount(amount):
+    """Turn an investment amount such as "100000" or "$250,000" into a float, or None"""
+    try:
+        return float(AMOUNT_PATTERN.sub("", str(amount)))
+    except ValueError:
+        return None
+
+
+class _Group:
+    __slots__ = ("count", "capital", "allocated", "weight_sums", "capital_by_asset", "histograms")
+
+    def __init__(self):
+        self.count = 0
+        self.capital = 0.0
+        self.allocated = 0  # portfolios whose allocation could be parsed
+        self.weight_sums = [0.0] * len(ASSET_CLASSES)
+        self.capital_by_asset = [0.0] * len(ASSET_CLASSES)
+        self.histograms = [[0] * HISTOGRAM_BUCKETS for _ in ASSET_CLASSES]
+
+    def add(self, amount, weights):
+        self.count += 1
+        if amount is not None:
+            self.capital += amount
+        if weights is None:
+            return
+        self.allocated += 1
+        for i, weight in enumerate(weights):
+            self.weight_sums[i] += weight
+            if amount is not None:
+                self.capital_by_asset[i] += amount * weight
+            bucket = min(int(weight * 100 // HISTOGRAM_BUCKET_WIDTH), HISTOGRAM_BUCKETS - 1)
+            self.histograms[i][bucket] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "capital": round(self.capital, 2),
+            "capital_by_asset": {
+                asset: round(value, 2) for asset, value in zip(ASSET_CLASSES, self.capital_by_asset)
+            },
+            "average_weights": {
+                asset: round(100 * total / self.allocated, 2) if self.allocated else None
+                for asset, total in zip(ASSET_CLASSES, self.weight_sums)
+            },
+            "weight_histograms": dict(zip(ASSET_CLASSES, self.histograms)),
+        }
+
+
+class PortfolioStats:
+    """Running aggregates over every stored portfolio"""
+
+    # Dimension name -> function returning the group key for (portfolio_data, created_at)
+    DIMENSIONS = {
+        "by_risk_level": lambda data, created: data["risk_level"],
+        "by_portfolio_name": lambda data, created: data["portfolio_name"],
+        "by_day": lambda data, created: created.date().isoformat(),
+        "by_week": lambda data, created: "{}-W{:02d}".format(*created.isocalendar()[:2]),
+    }
+
+    def __init__(self):
+        # save_portfolio runs in threadpool threads
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.total = _Group()
+        self.groups = {dimension: {} for dimension in self.DIMENSIONS}
+        self.skipped = 0  # portfolios that could not be aggregated at all
+        self._snapshot = None
+
+    def add(self, portfolio_data, created_at):
+        """Add one stored portfolio to the aggregates"""
+        try:
+            created = datetime.fromisoformat(created_at)
+            keys = {dimension: key(portfolio_data, created) for dimension, key in self.DIMENSIONS.items()}
+            for key in keys.values():
+                if not isinstance(key, str):
+                    raise TypeError(f"group key must be a string, got {type(key).__name__}")
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Error adding portfolio to stats: {e}")
+            with self._lock:
+                self.skipped += 1
+                self._snapshot = None
+            return
+
+        amount = parse_amount(portfolio_data.get("investment_amount"))
+        try:
+            weights = parse_allocation(portfolio_data.get("allocation") or "").tolist()
+        except (TypeError, ValueError):
+            weights = None
+
+        with self._lock:
+            self.total.add(amount, weights)
+            for dimension, key in keys.items():
+                group = self.groups[dimension].get(key)
+                if group is None:
+                    group = self.groups[dimension][key] = _Group()
+                group.add(amount, weights)
+            self._snapshot = None
+
+    def rebuild(self, portfolios):
+        """Recompute the aggregates from (portfolio_data, created_at) pairs"""
+        with self._lock:
+            self._reset()
+        for portfolio_data, created_at in portfolios:
+            # One bad record must not keep the server from starting
+            try:
+                self.add(portfolio_data, created_at)
+            except Exception as e:
+                print(f"Error adding portfolio to stats: {e}")
+                with self._lock:
+                    self.skipped += 1
+
+    def snapshot(self):
+        """Return (body, etag) of the encoded aggregates, re-encoded only after a write"""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self._encode()
+            return self._snapshot
+
+    def _encode(self):
+        body = dumps({
+            "asset_classes": ASSET_CLASSES,
+            "histogram_bucket_width": HISTOGRAM_BUCKET_WIDTH,
+            "skipped": self.skipped,
+            "total": self.total.to_dict(),
+            **{
+                dimension: {key: group.to_dict() for key, group in sorted(groups.items())}
+                for dimension, groups in self.groups.items()
+            },
+        })
+        return body, compute_etag(body)
+
+
+portfolio_stats = PortfolioStats()
@@ -0,0 +1,268 @@
+"""
+Serialize-once storage for portfolios
+
+Portfolios never change after they are written, so each one is encoded to compact
+JSON bytes exactly once, in the response shape {"portfolio_id", "portfolio_data"}.
+The same bytes are appended to the packed portfolio log (see segment_log.py) and
+kept in the in-memory cache together with their ETag.
+
+On ingest, nested API envelopes in response_json are flattened and large advice
+bodies are moved into the blob store (see blob_store.py). References are resolved
+the first time a portfolio is read and the resolved body is cached.
+"""
+
+import os
+from datetime import datetime
+from json_codec import dumps, loads
+from http_cache import compute_etag
+from blob_store import flatten_response_json, dedupe, resolve, has_blob_refs
+from segment_log import SegmentLog, STORE_DIR
+from portfolio_stats import portfolio_stats
+
+# Legacy one-file-per-portfolio directories, read until migrated into the log
+# (generate-portfolio used PORTFOLIOS_DIR, portfolios/store used DATA_DIR)
+PORTFOLIOS_DIR = "portfolios"
+DATA_DIR = "./data"
+LEGACY_DIRS = (PORTFOLIOS_DIR, DATA_DIR)
+
+# Packed append-only log holding every portfolio written since
+portfolio_log = SegmentLog(STORE_DIR)
+
+# Fields every stored portfolio_data must have (see ToolhouseData in main.py)
+PORTFOLIO_FIELDS = ("portfolio_name", "risk_level", "investment_amount", "allocation", "response_json")
+
+# Files written by this module already hold the encoded response body
+ENCODED_PREFIX = b'{"portfolio_id":'
+
+
+class CachedPortfolio:
+    """Encoded stored portfolio plus what list/latest need to know about it
+
+    `stored` holds the bytes as written to disk, possibly with blob references.
+    `body` is the response body with references resolved, built on first access.
+    Blob IDs are content hashes, so the ETag of the stored bytes also identifies the body.
+    `compressed` caches the compressed body per content-coding, filled in by http_cache.
+    """
+
+    __slots__ = ("portfolio_id", "stored", "etag", "summary", "compressed", "_body")
+
+    def __init__(self, portfolio_id, stored, summary):
+        self.portfolio_id = portfolio_id
+        self.stored = stored
+        self.etag = compute_etag(stored)
+        self.summary = summary
+        self.compressed = {}
+        self._body = None if has_blob_refs(stored) else stored
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = dumps(resolve(loads(self.stored)))
+        return self._body
+
+
+# In-memory cache of encoded portfolios
+# Structure: {portfolio_id: CachedPortfolio}
+portfolio_cache = {}
+
+
+def _summary(portfolio_id, portfolio_data, created_at):
+    return {
+        "id": portfolio_id,
+        "created_at": created_at,
+        "portfolio_name": resolve(portfolio_data["portfolio_name"]),
+        "risk_level": resolve(portfolio_data["risk_level"]),
+        "investment_amount": resolve(portfolio_data["investment_amount"]),
+    }
+
+
+def flatten_portfolio_data(portfolio_data):
+    """Return a copy of portfolio_data with nested API envelopes removed from response_json"""
+    return {**portfolio_data, "response_json": flatten_response_json(portfolio_data["response_json"])}
+
+
+def encode_portfolio(portfolio_id, portfolio_data, created_at=None, store_blobs=True, cache=True):
+    """Encode a validated portfolio_data dict once and, with cache, cache the result
+
+    With store_blobs, large strings in response_json are written to the blob store and
+    referenced by ID.
+    """
+    created_at = created_at or datetime.now().isoformat()
+    portfolio_data = flatten_portfolio_data(portfolio_data)
+    # Only the advice bodies go to the blob store; summary fields stay inline
+    portfolio_data = {**portfolio_data, "response_json": dedupe(portfolio_data["response_json"], store_blobs)}
+    stored = dumps({"portfolio_id": portfolio_id, "portfolio_data": portfolio_data})
+    cached = CachedPortfolio(portfolio_id, stored, _summary(portfolio_id, portfolio_data, created_at))
+    if cache:
+        portfolio_cache[portfolio_id] = cached
+    return cached
+
+
+def save_portfolio(portfolio_id, portfolio_data):
+    """Encode a validated portfolio_data dict, append it to the portfolio log and cache it"""
+    # Cached only once the log accepted it, so a refused duplicate ID leaves the original in place
+    cached = encode_portfolio(portfolio_id, portfolio_data, cache=False)
+    portfolio_log.append(portfolio_id, cached.stored, cached.summary["created_at"])
+    portfolio_cache[portfolio_id] = cached
+    portfolio_stats.add(portfolio_data, cached.summary["created_at"])
+    print(f"Portfolio {portfolio_id} saved to {portfolio_log.directory}")
+    return cached
+
+
+def _normalize_legacy(portfolio_id, data):
+    """Bring a legacy file into (portfolio_id, portfolio_data, created_at)
+
+    Legacy files come in two shapes: a bare portfolio_data dict (portfolios/)
+    and {"id", "created_at", "portfolio_data"} (data/).
+    """
+    if "portfolio_data" in data:
+        portfolio_id = data.get("portfolio_id") or data.get("id") or portfolio_id
+        created_at = data.get("created_at")
+        data = data["portfolio_data"]
+    else:
+        created_at = None
+
+    missing = [field for field in PORTFOLIO_FIELDS if field not in data]
+    if missing:
+        raise ValueError(f"Portfolio {portfolio_id} is missing fields: {', '.join(missing)}")
+
+    portfolio_data = {field: data[field] for field in PORTFOLIO_FIELDS}
+    return portfolio_id, portfolio_data, created_at
+
+
+def _cache_stored(portfolio_id, stored, created_at):
+    """Cache bytes that are already in stored shape, only the summary needs decoding"""
+    portfolio_data = loads(stored)["portfolio_data"]
+    cached = CachedPortfolio(portfolio_id, stored, _summary(portfolio_id, portfolio_data, created_at))
+    portfolio_cache[portfolio_id] = cached
+    return cached
+
+
+def read_legacy_file(portfolio_id, file_path):
+    """Read a one-file-per-portfolio JSON file in any of its historical shapes
+
+    Returns (portfolio_data, created_at) without caching or writing anything.
+    """
+    with open(file_path, "rb") as f:
+        raw = f.read()
+
+    created_at = datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
+    if raw.startswith(ENCODED_PREFIX):
+        # Written by this module before the portfolio log existed
+        data = loads(raw)
+        portfolio_data = resolve(data["portfolio_data"])
+    else:
+        _, portfolio_data, legacy_created_at = _normalize_legacy(portfolio_id, loads(raw))
+        created_at = legacy_created_at or created_at
+    return portfolio_data, created_at
+
+
+def encode_legacy_file(portfolio_id, file_path, store_blobs=True):
+    """Read a legacy JSON file and encode it"""
+    portfolio_data, created_at = read_legacy_file(portfolio_id, file_path)
+    return encode_portfolio(portfolio_id, portfolio_data, created_at, store_blobs=store_blobs)
+
+
+def load_portfolio(portfolio_id):
+    """Return the CachedPortfolio for portfolio_id, loading it from the store once, or None"""
+    cached = portfolio_cache.get(portfolio_id)
+    if cached is not None:
+        return cached
+
+    record = portfolio_log.get(portfolio_id)
+    if record is not None:
+        payload, created_at = record
+        return _cache_stored(portfolio_id, bytes(payload), created_at)
+
+    for directory in LEGACY_DIRS:
+        file_path = os.path.join(directory, f"{portfolio_id}.json")
+        if os.path.exists(file_path):
+            # Legacy files are normalized in memory only, the read path does not write blobs
+            return encode_legacy_file(portfolio_id, file_path, store_blobs=False)
+
+    return None
+
+
+def latest_portfolio_id():
+    """Return the ID of the most recently created portfolio, or None if there are none"""
+    # The cache only holds portfolios written or read since startup, so compare it with the log
+    candidates = [(p.summary["created_at"], p.portfolio_id) for p in portfolio_cache.values()]
+    log_latest = portfolio_log.latest()
+    if log_latest is not None:
+        candidates.append((log_latest[1], log_latest[0]))
+    if candidates:
+        return max(candidates)[1]
+
+    # Nothing in the log yet, fall back to the most recently modified legacy file
+    for directory in LEGACY_DIRS:
+        if os.path.exists(directory):
+            portfolio_files = [f for f in os.listdir(directory) if f.endswith('.json')]
+            if portfolio_files:
+                latest_file = max(portfolio_files, key=lambda x: os.path.getmtime(os.path.join(directory, x)))
+                return latest_file[:-len('.json')]
+
+    return None
+
+
+def list_summaries():
+    """Summaries of every stored portfolio, newest first"""
+    portfolio_ids = list(portfolio_cache) + portfolio_log.ids()
+    for directory in LEGACY_DIRS:
+        if os.path.exists(directory):
+            portfolio_ids += [f[:-len('.json')] for f in os.listdir(directory) if f.endswith('.json')]
+
+    summaries = {}
+    for portfolio_id in portfolio_ids:
+        if portfolio_id in summaries:
+            continue
+        try:
+            summaries[portfolio_id] = load_portfolio(portfolio_id).summary
+        except Exception as e:
+            print(f"Error reading portfolio {portfolio_id}: {e}")
+
+    return sorted(summaries.values(), key=lambda s: s["created_at"], reverse=True)
+
+
+def _summary_fields(portfolio_data):
+    """portfolio_data without response_json, with any blob references resolved
+
+    Records written before only response_json went to the blob store can hold
+    references in these fields too.
+    """
+    return {key: resolve(value) for key, value in portfolio_data.items() if key != "response_json"}
+
+
+def iter_stored_portfolios():
+    """Yield (portfolio_data, created_at) for every stored portfolio, without response_json
+
+    Nothing is added to the cache, so this does not change what latest_portfolio_id sees.
+    Records that cannot be read are logged and skipped.
+    """
+    seen = set()
+    for portfolio_id in portfolio_log.ids():
+        seen.add(portfolio_id)
+        try:
+            record = portfolio_log.get(portfolio_id)
+            if record is None:
+                continue
+            payload, created_at = record
+            portfolio_data = _summary_fields(loads(bytes(payload))["portfolio_data"])
+        except Exception as e:
+            print(f"Error reading portfolio {portfolio_id}: {e}")
+            continue
+        yield portfolio_data, created_at
+
+    for directory in LEGACY_DIRS:
+        if not os.path.exists(directory):
+            continue
+        for filename in os.listdir(directory):
+            portfolio_id = filename[:-len('.json')]
+            if not filename.endswith('.json') or portfolio_id in seen:
+                continue
+            seen.add(portfolio_id)
+            try:
+                portfolio_data, created_at = read_legacy_file(portfolio_id, os.path.join(directory, filename))
+            except Exception as e:
+                print(f"Error reading portfolio {portfolio_id}: {e}")
+                continue
+            yield _summary_fields(portfolio_data), created_at
@@ -0,0 +1,145 @@
+"""
+Vectorized rebalancing across many accounts
+
+Each account holds amounts per asset class and follows the target allocation of a
+stored portfolio. rebalance_accounts computes the trades that bring every account
+back to its target in a single NumPy pass over an (accounts x asset classes) matrix.
+
+Options:
+- drift_threshold: accounts whose weights are all within this distance of the target
+  are left alone (unless they have a cash flow to place)
+- min_trade: trades smaller than this amount are dropped
+- cash_only: never sell; only the account's cash flow (deposit or withdrawal) is
+  used, directed at the most underweight (or, for withdrawals, overweight) classes
+"""
+
+import re
+import numpy as np
+from portfolio_generator import ASSET_CLASSES
+
+# Names used for asset classes in allocation strings, mapped to ASSET_CLASSES
+ASSET_ALIASES = {
+    "stock": "Stocks", "stocks": "Stocks", "equities": "Stocks",
+    "bond": "Bonds", "bonds": "Bonds",
+    "cash": "Cash",
+    "crypto": "Crypto", "cryptocurrency": "Crypto", "cryptocurrencies": "Crypto",
+    "etf": "ETF", "etfs": "ETF",
+}
+ALLOCATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*%\s*([A-Za-z]+)")
+
+
+def parse_allocation(allocation):
+    """Turn an allocation such as "70% Stocks, 10% Bonds, 20% ETFs" into target weights
+
+    Returns an array of weights over ASSET_CLASSES that sums to 1.
+    """
+    weights = np.zeros(len(ASSET_CLASSES))
+    for percentage, name in ALLOCATION_PATTERN.findall(allocation):
+        asset = ASSET_ALIASES.get(name.lower())
+        if asset is None:
+            raise ValueError(f"Unknown asset class {name!r} in allocation {allocation!r}")
+        weights[ASSET_CLASSES.index(asset)] += float(percentage)
+
+    total = weights.sum()
+    if total <= 0:
+        raise ValueError(f"Allocation {allocation!r} has no asset percentages")
+    return weights / total
+
+
+def build_account_matrices(accounts, portfolio_targets):
+    """Turn accounts into the (holdings, targets, cash_flows) arrays rebalance_accounts takes
+
+    Each account has account_id, holdings (asset class name -> amount), cash_flow and
+    either a target_allocation string or a portfolio_id, whose weights come from
+    portfolio_targets(portfolio_id). Holdings keys are resolved through ASSET_ALIASES
+    and each distinct target is parsed once. Raises ValueError for unknown asset
+    classes and accounts without a target.
+    """
+    holding_rows = []
+    cash_flows = np.fromiter((account.cash_flow for account in accounts), dtype=float, count=len(accounts))
+    columns = {}  # holdings key -> column, resolved once per distinct key
+    target_rows = {}  # portfolio_id or allocation -> row in target_table
+    target_table = []
+    target_index = np.zeros(len(accounts), dtype=np.intp)
+
+    for row, account in enumerate(accounts):
+        target_key = account.target_allocation or account.portfolio_id
+        if target_key is None:
+            raise ValueError(f"Account {account.account_id} needs a portfolio_id or target_allocation")
+        if target_key not in target_rows:
+            target_rows[target_key] = len(target_table)
+            target_table.append(
+                parse_allocation(account.target_allocation) if account.target_allocation
+                else portfolio_targets(account.portfolio_id)
+            )
+        target_index[row] = target_rows[target_key]
+
+        holding_row = [0.0] * len(ASSET_CLASSES)
+        for name, amount in account.holdings.items():
+            column = columns.get(name)
+            if column is None:
+                asset = ASSET_ALIASES.get(name.lower())
+                if asset is None:
+                    raise ValueError(f"Unknown asset class {name!r} for account {account.account_id}")
+                column = columns[name] = ASSET_CLASSES.index(asset)
+            holding_row[column] += amount
+        holding_rows.append(holding_row)
+
+    holdings = np.array(holding_rows).reshape(-1, len(ASSET_CLASSES))
+    targets = np.array(target_table).reshape(-1, len(ASSET_CLASSES))[target_index]
+    return holdings, targets, cash_flows
+
+
+def rebalance_accounts(holdings, targets, cash_flows=None, drift_threshold=0.0, min_trade=0.0, cash_only=False):
+    """Compute rebalancing trades for many accounts at once
+
+    Args:
+        holdings: (accounts, asset classes) current amounts
+        targets: (accounts, asset classes) target weights, each row summing to 1
+        cash_flows: (accounts,) amount deposited (positive) or withdrawn (negative)
+        drift_threshold: largest allowed |weight - target| before an account is rebalanced
+        min_trade: trades with a smaller absolute amount are dropped
+        cash_only: only place the cash flow, never sell to rebalance
+
+    Returns:
+        (trades, max_drift): trades is (accounts, asset classes), positive to buy and
+        negative to sell; max_drift is (accounts,) the largest weight deviation.
+    """
+    holdings = np.asarray(holdings, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    cash_flows = np.zeros(len(holdings)) if cash_flows is None else np.asarray(cash_flows, dtype=float)
+
+    invested = holdings.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(invested[:, None] > 0, holdings / invested[:, None], 0.0)
+    max_drift = np.abs(weights - targets).max(axis=1)
+
+    # Amounts each class should hold once the cash flow is in
+    target_values = targets * np.maximum(invested + cash_flows, 0.0)[:, None]
+    gaps = target_values - holdings
+
+    if cash_only:
+        # Deposits go to underweight classes, withdrawals come from overweight ones,
+        # each in proportion to how far the class is from its target. Since the gaps
+        # of an account sum to its cash flow, this never overshoots a target.
+        deficits = np.maximum(gaps, 0.0)
+        surpluses = np.maximum(-gaps, 0.0)
+        deposit = np.maximum(cash_flows, 0.0)
+        # An account cannot sell more than it holds
+        withdrawal = np.minimum(np.maximum(-cash_flows, 0.0), invested)
+
+        deficit_total = deficits.sum(axis=1)
+        surplus_total = surpluses.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            buys = np.where(deficit_total[:, None] > 0, deficits / deficit_total[:, None], targets)
+            sells = np.where(surplus_total[:, None] > 0, surpluses / surplus_total[:, None], weights)
+        trades = buys * deposit[:, None] - sells * withdrawal[:, None]
+    else:
+        trades = gaps
+
+    # Leave accounts alone when they are within the threshold and have no cash to place
+    active = (max_drift > drift_threshold) | (cash_flows != 0)
+    trades = np.where(active[:, None], trades, 0.0)
+    if min_trade > 0:
+        trades = np.where(np.abs(trades) >= min_trade, trades, 0.0)
+    return trades, max_drift
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Packed append-only log for stored portfolios
+
+All portfolios live in one segment file instead of one JSON file each. Every record is
+
+    header (magic, id length, created_at length, payload length, crc32) | id | created_at | payload
+
+where payload is the stored portfolio exactly as portfolio_store encodes it. A compact
+binary index of (id, offset) entries sits next to the segment, and reads go through
+an mmap of the segment, so fetching a portfolio by ID is a dict lookup and a slice.
+
+Segment and index files are versioned by generation (portfolios.<gen>.seg/.idx) and
+the CURRENT file names the live generation. Compaction writes a new generation and
+swaps CURRENT atomically, so it can run while the API is serving. Writers, across
+threads and processes, serialize on a file lock.
+
+Usage:
+    python segment_log.py migrate   # import legacy portfolios/ and data/ JSON files
+    python segment_log.py compact   # rewrite the log keeping one record per ID
+    python segment_log.py stats
+"""
+
+import os
+import sys
+import mmap
+import zlib
+import fcntl
+import struct
+import argparse
+import threading
+
+STORE_DIR = "store"
+
+# magic, id length, created_at length, payload length, crc32 of payload
+RECORD_HEADER = struct.Struct("<2sHBII")
+RECORD_MAGIC = b"PF"
+# id length, then id bytes, then record offset
+INDEX_ID_LEN = struct.Struct("<H")
+INDEX_OFFSET = struct.Struct("<Q")
+
+# Compact once dead records take up more than this share of the segment
+COMPACTION_GARBAGE_RATIO = 0.3
+
+
+class SegmentLog:
+    """Append-only portfolio log with an in-memory offset index and mmap-backed reads"""
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._lock_path = os.path.join(directory, "LOCK")
+        self._current_path = os.path.join(directory, "CURRENT")
+        self._generation = None
+        self._index = {}  # portfolio_id -> record offset
+        self._index_pos = 0  # bytes of the index file already loaded
+        self._segment_end = 0  # end of the last indexed record
+        self._live_bytes = 0
+        self._latest = None  # (portfolio_id, created_at) of the newest record
+        self._mmap = None
+        self._open_generation()
+
+    # Files and generations
+
+    def _paths(self, generation):
+        base = os.path.join(self.directory, f"portfolios.{generation}")
+        return f"{base}.seg", f"{base}.idx"
+
+    def _read_current(self):
+        try:
+            with open(self._current_path) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+
+    def _write_current(self, generation):
+        tmp_path = f"{self._current_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._current_path)
+
+    def _file_lock(self):
+        """Exclusive lock shared by every process writing to this directory"""
+        return _FileLock(self._lock_path, self._lock)
+
+    def _open_generation(self):
+        with self._lock:
+            generation = self._read_current()
+            segment_path, index_path = self._paths(generation)
+            for path in (segment_path, index_path):
+                if not os.path.exists(path):
+                    open(path, "ab").close()
+
+            self._close_mmap()
+            self._generation = generation
+            self._index = {}
+            self._index_pos = 0
+            self._segment_end = 0
+            self._live_bytes = 0
+            self._latest = None
+            self._load_index()
+            self._recover_tail()
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A memoryview handed out by get() still references the old map,
+                # it is released once the last reader drops it
+                pass
+            self._mmap = None
+
+    def _refresh(self):
+        """Pick up compactions and appends made by other processes"""
+        if self._read_current() != self._generation:
+            self._open_generation()
+            return
+        _, index_path = self._paths(self._generation)
+        if os.path.getsize(index_path) > self._index_pos:
+            self._load_index()
+
+    def _map(self, min_size):
+        """Return an mmap of the segment covering at least min_size bytes"""
+        if self._mmap is None or len(self._mmap) < min_size:
+            self._close_mmap()
+            segment_path, _ = self._paths(self._generation)
+            if os.path.getsize(segment_path) == 0:
+                return b""  # mmap cannot map an empty file
+            with open(segment_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    # Index
+
+    def _load_index(self):
+        _, index_path = self._paths(self._generation)
+        with open(index_path, "rb") as f:
+            f.seek(self._index_pos)
+            data = f.read()
+
+        pos = 0
+        while pos + INDEX_ID_LEN.size <= len(data):
+            (id_len,) = INDEX_ID_LEN.unpack_from(data, pos)
+            end = pos + INDEX_ID_LEN.size + id_len + INDEX_OFFSET.size
+            if end > len(data):
+                break  # partially written entry, re-read on the next refresh
+            portfolio_id = data[pos + INDEX_ID_LEN.size:pos + INDEX_ID_LEN.size + id_len].decode("utf-8")
+            (offset,) = INDEX_OFFSET.unpack_from(data, end - INDEX_OFFSET.size)
+            self._track(portfolio_id, offset)
+            pos = end
+        self._index_pos += pos
+
+    def _track(self, portfolio_id, offset):
+        record_size, created_at = self._record_info(offset)
+        previous = self._index.get(portfolio_id)
+        if previous is not None:
+            self._live_bytes -= self._record_size(previous)
+        self._index[portfolio_id] = offset
+        self._live_bytes += record_size
+        self._segment_end = max(self._segment_end, offset + record_size)
+        if self._latest is None or created_at >= self._latest[1]:
+            self._latest = (portfolio_id, created_at)
+
+    def _record_info(self, offset):
+        """Return (record size, created_at) of the record at offset"""
+        segment = self._map(offset + RECORD_HEADER.size)
+        _, id_len, created_len, payload_len, _ = RECORD_HEADER.unpack_from(segment, offset)
+        start = offset + RECORD_HEADER.size + id_len
+        segment = self._map(start + created_len)
+        created_at = segment[start:start + created_len].decode("utf-8")
+        return RECORD_HEADER.size + id_len + created_len + payload_len, created_at
+
+    def _record_size(self, offset):
+        return self._record_info(offset)[0]
+
+    def _recover_tail(self):
+        """Index records appended after the last index entry, e.g. after a crash between writes"""
+        segment_path, index_path = self._paths(self._generation)
+        segment_size = os.path.getsize(segment_path)
+        offset = self._segment_end
+        recovered = []
+        while offset + RECORD_HEADER.size <= segment_size:
+            segment = self._map(segment_size)
+            magic, id_len, created_len, payload_len, crc = RECORD_HEADER.unpack_from(segment, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + id_len + created_len + payload_len
+            if magic != RECORD_MAGIC or end > segment_size or zlib.crc32(segment[end - payload_len:end]) != crc:
+                break  # torn write, the next append overwrites it
+            recovered.append((segment[start:start + id_len].decode("utf-8"), offset))
+            offset = end
+
+        if recovered:
+            with self._file_lock(), open(index_path, "ab") as f:
+                for portfolio_id, record_offset in recovered:
+                    f.write(_index_entry(portfolio_id, record_offset))
+            self._load_index()
+
+    # Reads
+
+    def get(self, portfolio_id):
+        """Return (payload, created_at) for portfolio_id or None
+
+        payload is a memoryview into the mapped segment, valid until the next compaction.
+        """
+        with self._lock:
+            offset = self._index.get(portfolio_id)
+            if offset is None:
+                self._refresh()
+                offset = self._index.get(portfolio_id)
+                if offset is None:
+                    return None
+
+            segment = self._map(offset + RECORD_HEADER.size)
+            _, id_len, created_len, payload_len, _ = RECORD_HEADER.unpack_from(segment, offset)
+            start = offset + RECORD_HEADER.size + id_len
+            segment = self._map(start + created_len + payload_len)
+            created_at = segment[start:start + created_len].decode("utf-8")
+            payload = memoryview(segment)[start + created_len:start + created_len + payload_len]
+            return payload, created_at
+
+    def __contains__(self, portfolio_id):
+        with self._lock:
+            if portfolio_id not in self._index:
+                self._refresh()
+            return portfolio_id in self._index
+
+    def ids(self):
+        with self._lock:
+            self._refresh()
+            return list(self._index)
+
+    def latest(self):
+        """Return (portfolio_id, created_at) of the most recently created record, or None"""
+        with self._lock:
+            self._refresh()
+            return self._latest
+
+    # Writes
+
+    def append(self, portfolio_id, payload, created_at):
+        """Append a record for a new ID; portfolios are immutable, so an existing ID is refused"""
+        id_bytes = portfolio_id.encode("utf-8")
+        created_bytes = created_at.encode("utf-8")
+        header = RECORD_HEADER.pack(RECORD_MAGIC, len(id_bytes), len(created_bytes), len(payload), zlib.crc32(payload))
+
+        with self._file_lock():
+            self._refresh()
+            if portfolio_id in self._index:
+                raise ValueError(f"Portfolio {portfolio_id} is already stored")
+            segment_path, index_path = self._paths(self._generation)
+            with open(segment_path, "r+b") as f:
+                # Start after the last complete record, overwriting any torn tail
+                offset = self._segment_end
+                f.seek(offset)
+                f.write(header + id_bytes + created_bytes + payload)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            with open(index_path, "ab") as f:
+                f.write(_index_entry(portfolio_id, offset))
+            self._load_index()
+
+    def garbage_ratio(self):
+        with self._lock:
+            if not self._segment_end:
+                return 0.0
+            return 1 - self._live_bytes / self._segment_end
+
+    def compact(self):
+        """Rewrite the live records into a new generation and switch to it
+
+        The live records are copied without holding the lock, so reads and appends
+        carry on meanwhile. Only the records appended during the copy are copied
+        under the lock, right before the switch.
+        """
+        with self._lock:
+            self._refresh()
+            old_generation = self._generation
+            copied_end = self._segment_end
+            live = sorted(self._index.items(), key=lambda item: item[1])
+
+        old_segment_path, old_index_path = self._paths(old_generation)
+        segment_path, index_path = self._paths(old_generation + 1)
+        tmp_paths = (f"{segment_path}.{os.getpid()}.tmp", f"{index_path}.{os.getpid()}.tmp")
+        switched = False
+        try:
+            with open(old_segment_path, "rb") as src, open(tmp_paths[0], "wb") as seg_f, open(tmp_paths[1], "wb") as idx_f:
+                _copy_records(src, seg_f, idx_f, live)
+                _sync(seg_f, idx_f)
+
+                with self._file_lock():
+                    self._refresh()
+                    if self._generation != old_generation:
+                        print("Portfolio log was compacted by another process, skipping")
+                        return
+                    appended = sorted(
+                        ((portfolio_id, offset) for portfolio_id, offset in self._index.items() if offset >= copied_end),
+                        key=lambda item: item[1],
+                    )
+                    _copy_records(src, seg_f, idx_f, appended)
+                    _sync(seg_f, idx_f)
+
+                    before = self._segment_end
+                    os.replace(tmp_paths[0], segment_path)
+                    os.replace(tmp_paths[1], index_path)
+                    switched = True
+                    self._write_current(old_generation + 1)
+                    self._open_generation()
+                    for path in (old_segment_path, old_index_path):
+                        os.remove(path)
+        finally:
+            if not switched:
+                for path in tmp_paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        print(f"Compacted portfolio log from {before} to {self._segment_end} bytes")
+
+    def compact_if_needed(self, garbage_ratio=COMPACTION_GARBAGE_RATIO):
+        if self.garbage_ratio() > garbage_ratio:
+            self.compact()
+            return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                "generation": self._generation,
+                "portfolios": len(self._index),
+                "segment_bytes": self._segment_end,
+                "live_bytes": self._live_bytes,
+                "garbage_ratio": round(self.garbage_ratio(), 3),
+            }
+
+
+class _FileLock:
+    """Thread lock plus an exclusive flock on a lock file"""
+
+    def __init__(self, path, thread_lock):
+        self.path = path
+        self.thread_lock = thread_lock
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.thread_lock.release()
+
+
+def _copy_records(src, seg_f, idx_f, entries):
+    """Copy the records at the given (portfolio_id, offset) entries from src to a new segment and index"""
+    for portfolio_id, offset in entries:
+        src.seek(offset)
+        header = src.read(RECORD_HEADER.size)
+        _, id_len, created_len, payload_len, _ = RECORD_HEADER.unpack(header)
+        idx_f.write(_index_entry(portfolio_id, seg_f.tell()))
+        seg_f.write(header + src.read(id_len + created_len + payload_len))
+
+
+def _sync(*files):
+    for f in files:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _index_entry(portfolio_id, offset):
+    id_bytes = portfolio_id.encode("utf-8")
+    return INDEX_ID_LEN.pack(len(id_bytes)) + id_bytes + INDEX_OFFSET.pack(offset)
+
+
+def migrate(log, directories):
+    """Stream legacy JSON files from directories into the log, skipping IDs it already has"""
+    # Imported here so the log itself has no dependency on the portfolio layer
+    from portfolio_store import encode_legacy_file
+
+    migrated = 0
+    for directory in directories:
+        if not os.path.exists(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".json"):
+                continue
+            portfolio_id = filename[:-len(".json")]
+            if portfolio_id in log:
+                continue
+            try:
+                cached = encode_legacy_file(portfolio_id, os.path.join(directory, filename))
+            except Exception as e:
+                print(f"Skipping {directory}/{filename}: {e}")
+                continue
+            log.append(portfolio_id, cached.stored, cached.summary["created_at"])
+            migrated += 1
+
+    print(f"Migrated {migrated} portfolios into {log.directory}")
+    return migrated
+
+
+def main():
+    from portfolio_store import PORTFOLIOS_DIR, DATA_DIR
+
+    parser = argparse.ArgumentParser(description='Manage the packed portfolio log')
+    parser.add_argument('command', choices=['migrate', 'compact', 'stats'])
+    parser.add_argument('--store-dir', type=str, default=STORE_DIR, help='Directory holding the log')
+    parser.add_argument('--source', type=str, action='append', help='Legacy directory to migrate (repeatable)')
+    args = parser.parse_args()
+
+    log = SegmentLog(args.store_dir)
+    if args.command == 'migrate':
+        migrate(log, args.source or [PORTFOLIOS_DIR, DATA_DIR])
+    elif args.command == 'compact':
+        log.compact()
+    print(log.stats())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -68,24 +68,40 @@ export default function Page() {
   const [error, setError] = useState<string | null>(null)
 
   useEffect(() => {
-    fetch("/latest.json")
+    const showPortfolio = (data: any) => {
+      setJson(data)
+      setLoading(false)
+      try {
+        localStorage.setItem("latestPortfolio", JSON.stringify(data))
+      } catch (e) {
+        // Ignore localStorage errors
+      }
+    }
+
+    // Load the portfolio this browser just stored, falling back to the most recent one
+    const portfolioId = localStorage.getItem("portfolioId")
+    const url = portfolioId
+      ? `http://localhost:8000/api/portfolios/${encodeURIComponent(portfolioId)}`
+      : "http://localhost:8000/api/portfolios/latest"
+    fetch(url)
       .then((res) => {
         if (!res.ok) throw new Error(`Failed to fetch: ${res.statusText}`)
         return res.json()
       })
-      .then((data) => {
-        setJson(data)
-        setLoading(false)
-        try {
-          localStorage.setItem("latestPortfolio", JSON.stringify(data))
-        } catch (e) {
-          // Ignore localStorage errors
-        }
-      })
+      .then((data) => showPortfolio(data.portfolio_data))
       .catch((err) => {
         setError(err.message)
         setLoading(false)
       })
+
+    // Portfolios created later in this session are pushed by the backend
+    const sessionId = localStorage.getItem("sessionId")
+    if (!sessionId) return
+    const events = new EventSource(`http://localhost:8000/api/events?session_id=${encodeURIComponent(sessionId)}`)
+    events.addEventListener("portfolio.created", (event) => {
+      showPortfolio(JSON.parse((event as MessageEvent).data).portfolio_data)
+    })
+    return () => events.close()
   }, [])
 
   if (loading) {
@@ -283,7 +299,8 @@ export default function Page() {
               }
               
               // Extract relevant data from the raw text
-              const rawText = json?.response_json?.data?.response_json?.raw_text || ""
+              // Nested API envelopes are flattened by the backend, older files still carry them
+              const rawText = json?.response_json?.raw_text || json?.response_json?.data?.response_json?.raw_text || ""
               
               // Extract stocks data
               const stocksSection = rawText.match(/### 1\.[\s\S]*?(?=### 2\.)/)
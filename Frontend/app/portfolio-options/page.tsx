@@ -102,6 +102,16 @@ const formatRiskLevel = (riskLevel: string): "Conservative" | "Moderate" | "Aggr
   }
 };
 
+// Identifies this browser to the backend, which pushes new portfolios to the matching event stream
+const getSessionId = (): string => {
+  let sessionId = localStorage.getItem('sessionId');
+  if (!sessionId) {
+    sessionId = crypto.randomUUID();
+    localStorage.setItem('sessionId', sessionId);
+  }
+  return sessionId;
+};
+
 export default function PortfolioOptionsPage() {
   const [selectedPortfolio, setSelectedPortfolio] = useState<string>("");
   const [isSubmitting, setIsSubmitting] = useState<boolean>(false);
@@ -369,6 +379,7 @@ export default function PortfolioOptionsPage() {
               method: 'POST',
               headers: {
                 'Content-Type': 'application/json',
+                'X-Session-Id': getSessionId(),
               },
               body: JSON.stringify({
                 investment_amount: investmentAmount,
@@ -413,6 +424,7 @@ export default function PortfolioOptionsPage() {
                   method: 'POST',
                   headers: {
                     'Content-Type': 'application/json',
+                    'X-Session-Id': getSessionId(),
                   },
                   body: JSON.stringify({
                     portfolio_name: portfolioData.portfolio_name,